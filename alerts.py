@@ -0,0 +1,271 @@
+import os
+import math
+import time
+import heapq
+import itertools
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from database import Client
+from storage import AlertKey, AlertStore, TRAFFIC_SAMPLE_INTERVAL
+
+# Пороги квоты трафика в процентах
+ALERT_QUOTA_THRESHOLDS = tuple(sorted(int(value) for value in os.getenv('ALERT_QUOTA_THRESHOLDS', '80,95,100').split(',')))
+# За сколько дней до окончания подписки предупреждать (0 - в момент окончания)
+ALERT_EXPIRY_DAYS = tuple(sorted((int(value) for value in os.getenv('ALERT_EXPIRY_DAYS', '3,1,0').split(',')), reverse=True))
+# Максимальный интервал между проверками квоты клиента (прогноз по скорости расхода неточен)
+ALERT_MAX_RECHECK = float(os.getenv('ALERT_MAX_RECHECK', '21600'))
+# Окно, по которому оценивается скорость расхода трафика (секунды)
+ALERT_RATE_WINDOW = float(os.getenv('ALERT_RATE_WINDOW', '86400'))
+# Сколько событий обрабатывать за один проход
+ALERT_BATCH_SIZE = int(os.getenv('ALERT_BATCH_SIZE', '500'))
+
+# Подписки, закончившиеся раньше, не уведомляем (например, при первом запуске)
+EXPIRED_GRACE = 86400
+
+QUOTA = 'quota'
+EXPIRY = 'expiry'
+
+# Событие в очереди: (время срабатывания, порядковый номер, вид, email, поколение клиента)
+HeapEntry = Tuple[float, int, str, str, int]
+
+@dataclass(frozen=True, slots=True)
+class AlertNotice:
+    """Предупреждение для отправки: стадия - процент квоты или дней до окончания подписки"""
+    client: Client
+    kind: str
+    stage: int
+    used: int = 0
+
+def alert_fields(client: Client) -> Tuple:
+    """Поля клиента, от которых зависит расписание предупреждений"""
+    return (client.enable, client.total, client.expiry_time, client.tg_id)
+
+def format_alert(notice: AlertNotice) -> str:
+    """Текст предупреждения для клиента"""
+    client = notice.client
+    if notice.kind == QUOTA:
+        used_gb = round(notice.used / (1024**3), 3)
+        total_gb = round(client.total / (1024**3), 3)
+        if notice.stage >= 100:
+            message = f"⛔ Трафик для {client.email} исчерпан"
+        else:
+            message = f"⚠️ Израсходовано {notice.stage}% трафика для {client.email}"
+        return message + f"\n\n📊 Использовано: {used_gb}GB из {total_gb}GB"
+
+    expiry = datetime.fromtimestamp(client.expiry_time / 1000).strftime("%Y-%m-%d %H:%M")
+    if notice.stage == 0:
+        return f"⛔ Подписка {client.email} закончилась\n\n📅 Дата окончания: {expiry}"
+    # Стадия - порог предупреждения, фактически до окончания может оставаться меньше
+    left = client.expiry_time / 1000 - time.time()
+    left_info = f"{math.ceil(left / 86400)} дн." if left > 86400 else f"{max(1, math.ceil(left / 3600))} ч."
+    return f"⏳ Подписка {client.email} закончится через {left_info}\n\n📅 Дата окончания: {expiry}"
+
+class AlertScheduler:
+    """Очередь предупреждений о квоте и окончании подписки на min-heap по времени срабатывания
+
+    У клиента в куче не больше одного события каждого вида: ближайшая стадия окончания подписки
+    и проверка квоты к прогнозируемому пересечению следующего порога (по скорости расхода).
+    Перебора всех клиентов по таймеру нет: при изменении снимка события пересоздаются только
+    для изменившихся клиентов, а устаревшие записи кучи отбрасываются по поколению клиента.
+    """
+    def __init__(self, store: AlertStore, thresholds: Tuple[int, ...] = ALERT_QUOTA_THRESHOLDS,
+                 expiry_days: Tuple[int, ...] = ALERT_EXPIRY_DAYS, max_recheck: float = ALERT_MAX_RECHECK,
+                 min_recheck: float = TRAFFIC_SAMPLE_INTERVAL):
+        self.store = store
+        self.thresholds = thresholds
+        self.expiry_days = expiry_days
+        self.max_recheck = max_recheck
+        self.min_recheck = min_recheck
+        self.version: Optional[int] = None
+
+        self._sent: Set[AlertKey] = set()
+        self._sent_loaded = False  # Отметки читаются из БД при первой синхронизации, а не при создании
+        self._heap: List[HeapEntry] = []
+        self._clients: Dict[str, Tuple[Client, int]] = {}  # email -> (клиент, поколение)
+        self._seq = itertools.count()
+        self._unsaved: List[AlertKey] = []
+        self.stats = {'syncs': 0, 'rescheduled': 0, 'processed': 0, 'stale': 0, 'sent': 0}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _push(self, due: float, kind: str, email: str, generation: int):
+        heapq.heappush(self._heap, (due, next(self._seq), kind, email, generation))
+
+    def _is_stale(self, entry: HeapEntry) -> bool:
+        client_entry = self._clients.get(entry[3])
+        return client_entry is None or client_entry[1] != entry[4]
+
+    def sync(self, version: int, clients: Iterable[Client], now: float) -> int:
+        """Обновить расписание по снимку клиентов, вернуть число изменившихся клиентов"""
+        if version == self.version:
+            return 0
+        if not self._sent_loaded:
+            self._sent = self.store.load()
+            self._sent_loaded = True
+
+        seen = set()
+        changed = 0
+        entries: List[HeapEntry] = []
+        for client in clients:
+            if not client.email:
+                continue
+            seen.add(client.email)
+            entry = self._clients.get(client.email)
+            if entry is not None and alert_fields(entry[0]) == alert_fields(client):
+                self._clients[client.email] = (client, entry[1])
+                continue
+
+            generation = next(self._seq)
+            self._clients[client.email] = (client, generation)
+            if client.enable:
+                stage = self._expiry_stage(client, now)
+                if stage is not None:
+                    entries.append((max(stage[0], now), next(self._seq), EXPIRY, client.email, generation))
+                if client.total > 0:
+                    # Квоту проверяем сразу: прогноз строится по текущему расходу
+                    entries.append((now, next(self._seq), QUOTA, client.email, generation))
+            changed += 1
+
+        # Много новых событий (первый запуск) - перестраиваем кучу целиком за O(n)
+        if len(entries) > len(self._heap):
+            self._heap.extend(entries)
+            heapq.heapify(self._heap)
+        else:
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+
+        # События удаленных клиентов станут устаревшими
+        for email in self._clients.keys() - seen:
+            del self._clients[email]
+            changed += 1
+
+        self.version = version
+        self.stats['syncs'] += 1
+        self.stats['rescheduled'] += changed
+        return changed
+
+    def next_due(self) -> Optional[float]:
+        """Время ближайшего события (None - очередь пуста)"""
+        while self._heap and self._is_stale(self._heap[0]):
+            heapq.heappop(self._heap)
+            self.stats['stale'] += 1
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float, limit: int = ALERT_BATCH_SIZE) -> List[Tuple[str, Client]]:
+        """Извлечь наступившие события (вид, клиент)"""
+        due = []
+        while len(due) < limit:
+            next_due = self.next_due()
+            if next_due is None or next_due > now:
+                break
+            _, _, kind, email, _ = heapq.heappop(self._heap)
+            due.append((kind, self._clients[email][0]))
+        return due
+
+    def _expiry_stage(self, client: Client, now: float) -> Optional[Tuple[float, int]]:
+        """Ближайшая неотправленная стадия окончания подписки (время, дней до окончания)"""
+        if client.expiry_time <= 0:
+            return None
+        expiry = client.expiry_time / 1000
+        if expiry < now - EXPIRED_GRACE:
+            return None
+
+        # Из уже наступивших стадий актуальна только последняя
+        stages = [(expiry - days * 86400, days) for days in self.expiry_days]
+        current = max((due for due, _ in stages if due <= now), default=None)
+        for due, days in stages:
+            if current is not None and due < current:
+                continue
+            if (client.email, EXPIRY, days, client.expiry_time) not in self._sent:
+                return due, days
+        return None
+
+    def _schedule_expiry(self, client: Client, generation: int, now: float):
+        stage = self._expiry_stage(client, now)
+        if stage is not None:
+            self._push(max(stage[0], now), EXPIRY, client.email, generation)
+
+    def _mark(self, keys: List[AlertKey]):
+        # В БД отметки пишутся одной транзакцией в конце handle
+        self._unsaved.extend(keys)
+        self._sent.update(keys)
+
+    def _handle_expiry(self, client: Client, generation: int, now: float) -> Optional[AlertNotice]:
+        stage = self._expiry_stage(client, now)
+        if stage is None:
+            return None
+        due, days = stage
+        if due > now:
+            self._push(due, EXPIRY, client.email, generation)
+            return None
+
+        self._mark([(client.email, EXPIRY, days, client.expiry_time)])
+        self._schedule_expiry(client, generation, now)
+        return AlertNotice(client, EXPIRY, days)
+
+    def _handle_quota(self, client: Client, generation: int, used: int, rate: float, now: float) -> Optional[AlertNotice]:
+        keys = {percent: (client.email, QUOTA, percent, client.total) for percent in self.thresholds}
+        crossed = [percent for percent in self.thresholds if used >= client.total * percent / 100]
+        upcoming = [percent for percent in self.thresholds if percent not in crossed]
+
+        # Панель сбросила счетчик: пороги выше текущего расхода снова активны
+        rearmed = [keys[percent] for percent in upcoming if keys[percent] in self._sent]
+        if rearmed:
+            self.store.forget(rearmed)
+            self._sent.difference_update(rearmed)
+
+        notice = None
+        if crossed and keys[crossed[-1]] not in self._sent:
+            # Нижние пороги тоже считаем пройденными, чтобы не слать их после верхнего
+            self._mark([keys[percent] for percent in crossed])
+            notice = AlertNotice(client, QUOTA, crossed[-1], used)
+
+        # Следующая проверка - к прогнозу пересечения ближайшего порога
+        delay = self.max_recheck
+        if upcoming and rate > 0:
+            delay = (client.total * upcoming[0] / 100 - used) / rate
+        self._push(now + min(max(delay, self.min_recheck), self.max_recheck), QUOTA, client.email, generation)
+        return notice
+
+    def postpone(self, due: List[Tuple[str, Client]], now: float):
+        """Перенести события, которые не удалось проверить (например, БД недоступна)"""
+        for kind, client in due:
+            entry = self._clients.get(client.email)
+            if entry is not None:
+                self._push(now + self.min_recheck, kind, client.email, entry[1])
+
+    def handle(self, due: List[Tuple[str, Client]], usage: Dict[str, Tuple[int, int]],
+               recent: Dict[str, Tuple[int, int]], now: float, rate_window: float = ALERT_RATE_WINDOW) -> List[AlertNotice]:
+        """Обработать наступившие события и запланировать следующие
+
+        usage - текущие счетчики (up, down) клиентов с событиями квоты, recent - трафик за rate_window
+        """
+        notices = []
+        for kind, client in due:
+            entry = self._clients.get(client.email)
+            if entry is None:
+                continue
+            if kind == EXPIRY:
+                notice = self._handle_expiry(client, entry[1], now)
+            else:
+                counters = usage.get(client.email)
+                if counters is None:
+                    # Строки трафика нет - это не сброс счетчика: пороги не трогаем, проверим позже
+                    self._push(now + self.min_recheck, QUOTA, client.email, entry[1])
+                    continue
+                recent_up, recent_down = recent.get(client.email, (0, 0))
+                notice = self._handle_quota(client, entry[1], sum(counters),
+                                            (recent_up + recent_down) / rate_window, now)
+            if notice is not None:
+                notices.append(notice)
+
+        # Отметки сохраняются до отправки: при сбое предупреждение не повторится
+        if self._unsaved:
+            self.store.mark(self._unsaved)
+            self._unsaved = []
+
+        self.stats['processed'] += len(due)
+        self.stats['sent'] += len(notices)
+        return notices
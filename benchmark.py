@@ -0,0 +1,539 @@
+import sqlite3
+import json
+import hashlib
+import os
+import sys
+import time
+import uuid
+import asyncio
+import logging
+import tempfile
+import tracemalloc
+import threading
+from collections import deque
+from telegram.error import RetryAfter, TimedOut
+from database import Client, DatabaseManager, AsyncDatabaseManager, CONFIG_DIGEST_QUERY, TRAFFIC_DIGEST_QUERY, iter_json_clients, load_settings_compact
+from menu import build_menu_view, render_menu, render_menu_keyboard, render_menu_text
+from charts import ChartRenderer, render_usage_chart
+from stats import TrafficColumns, TrafficStatsEngine, compute_traffic_stats
+from storage import AlertStore, TrafficHistoryStore
+from alerts import AlertScheduler, QUOTA
+from broadcast import BroadcastEngine
+
+def create_test_database(db_path: str, clients_count: int, tg_users_count: int = 0):
+    """Создать синтетическую БД в формате 3x-ui с заданным числом клиентов"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    # По умолчанию у каждого пользователя в среднем по 2 клиента
+    tg_users_count = tg_users_count or max(1, clients_count // 2)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("""CREATE TABLE inbounds (
+        id INTEGER PRIMARY KEY, user_id INTEGER, up INTEGER, down INTEGER, total INTEGER,
+        remark TEXT, enable INTEGER, expiry_time INTEGER, listen TEXT, port INTEGER,
+        protocol TEXT, settings TEXT, stream_settings TEXT, tag TEXT, sniffing TEXT)""")
+    conn.execute("""CREATE TABLE client_traffics (
+        id INTEGER PRIMARY KEY, inbound_id INTEGER, enable INTEGER, email TEXT UNIQUE,
+        up INTEGER, down INTEGER, expiry_time INTEGER, total INTEGER, reset INTEGER)""")
+
+    clients = []
+    traffic_rows = []
+    for i in range(clients_count):
+        email = f"client_{i}@test.com"
+        clients.append({
+            'id': str(uuid.uuid4()),
+            'email': email,
+            'enable': True,
+            'total': 0,
+            'expiryTime': 0,
+            'limitIp': 0,
+            'flow': 'xtls-rprx-vision',
+            'tgId': 100000 + i % tg_users_count,
+            'subId': uuid.uuid4().hex[:16],
+            'comment': 'Тестовый клиент',
+            'reset': 0
+        })
+        traffic_rows.append((1, email, i * 1024 ** 2, i * 4 * 1024 ** 2))
+
+    stream_settings = {
+        'network': 'tcp',
+        'security': 'reality',
+        'realitySettings': {
+            'serverNames': ['example.com'],
+            'shortIds': ['0123abcd'],
+            'settings': {'publicKey': 'PUBLIC_KEY_EXAMPLE', 'fingerprint': 'chrome'}
+        }
+    }
+
+    conn.execute(
+        "INSERT INTO inbounds (id, remark, enable, listen, port, protocol, settings, stream_settings) VALUES (1, ?, 1, ?, ?, ?, ?, ?)",
+        ('bench', '127.0.0.1', 443, 'vless', json.dumps({'clients': clients, 'decryption': 'none'}), json.dumps(stream_settings))
+    )
+    conn.executemany(
+        "INSERT INTO client_traffics (inbound_id, enable, email, up, down, expiry_time, total, reset) VALUES (?, 1, ?, ?, ?, 0, 0, 0)",
+        traffic_rows
+    )
+    conn.commit()
+    conn.close()
+
+def measure(func, repeat: int = 3) -> float:
+    """Лучшее время выполнения функции в секундах"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_user_configs(work_dir: str):
+    """Генерация конфигов всех пользователей должна масштабироваться линейно"""
+    print("\n📊 get_all_user_configs (до 50k клиентов)")
+    per_client = []
+    for count in (1000, 5000, 10000, 50000):
+        db_path = os.path.join(work_dir, f"configs_{count}.db")
+        create_test_database(db_path, count)
+        db = DatabaseManager(db_path)
+        db.get_snapshot()  # Разбор JSON не входит в замер
+
+        elapsed = measure(db.get_all_user_configs)
+        per_client.append(elapsed / count)
+        print(f"   {count:>6} клиентов: {elapsed * 1000:8.1f} мс ({elapsed / count * 1e6:.2f} мкс/клиент)")
+
+    ratio = max(per_client) / min(per_client)
+    status = "✅ линейно" if ratio < 3 else "❌ нелинейно"
+    print(f"   Разброс времени на клиента: x{ratio:.2f} {status}")
+
+def bench_traffic_stats(work_dir: str):
+    """Статистика трафика для меню: запрос на каждый email против одного пакетного"""
+    print("\n📊 Статистика трафика для пользователя с большим числом устройств")
+    db_path = os.path.join(work_dir, "traffic.db")
+    create_test_database(db_path, 10000, tg_users_count=100)
+    db = DatabaseManager(db_path)
+
+    for devices in (1, 10, 100):
+        emails = [f"client_{i}@test.com" for i in range(devices)]
+        per_email = measure(lambda: [db.get_traffic_stats(email) for email in emails])
+        batched = measure(lambda: db.get_traffic_stats_many(emails))
+        print(f"   {devices:>3} устройств: по одному {per_email * 1000:7.2f} мс ({devices} запросов), "
+              f"пакетно {batched * 1000:6.2f} мс (1 запрос)")
+
+def hold_write_lock(db_path: str, seconds: float, locked: threading.Event):
+    """Имитировать писателя 3x-ui, удерживающего эксклюзивную блокировку БД"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("BEGIN EXCLUSIVE")
+    locked.set()
+    time.sleep(seconds)
+    conn.execute("COMMIT")
+    conn.close()
+
+async def measure_loop_lag(handler, duration: float) -> float:
+    """Максимальная задержка event loop, пока параллельно выполняется обработчик"""
+    max_lag = 0.0
+    tick = 0.01
+    task = asyncio.create_task(handler())
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline or not task.done():
+        start = time.perf_counter()
+        await asyncio.sleep(tick)
+        max_lag = max(max_lag, time.perf_counter() - start - tick)
+    await task
+    return max_lag
+
+def bench_locked_database(work_dir: str):
+    """Задержка event loop, пока писатель держит блокировку БД"""
+    print("\n📊 Обработчики при заблокированной писателем БД")
+    db_path = os.path.join(work_dir, "locked.db")
+    create_test_database(db_path, 1000)
+    db = DatabaseManager(db_path)
+    async_db = AsyncDatabaseManager(db)
+    db.get_snapshot()
+
+    async def sync_handler():
+        db.get_user_menu_data(100000)
+
+    async def async_handler():
+        await asyncio.gather(*(async_db.get_user_menu_data(100000 + i) for i in range(10)))
+
+    for name, handler in (("синхронный вызов", sync_handler), ("AsyncDatabaseManager", async_handler)):
+        locked = threading.Event()
+        writer = threading.Thread(target=hold_write_lock, args=(db_path, 1.0, locked))
+        writer.start()
+        locked.wait()
+        lag = asyncio.run(measure_loop_lag(handler, 0.2))
+        writer.join()
+        print(f"   {name:<22}: максимальная задержка event loop {lag * 1000:7.1f} мс")
+
+    async_db.shutdown()
+
+class FakeBot:
+    """Локальная имитация Bot API: задержка сети, глобальный лимит и случайные таймауты"""
+    def __init__(self, latency: float = 0.05, limit_per_second: int = 30, timeout_every: int = 50):
+        self.latency = latency
+        self.limit_per_second = limit_per_second
+        self.timeout_every = timeout_every
+        self.calls = 0
+        self.delivered = set()
+        self.retry_after_count = 0
+        self._recent = deque()
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.calls += 1
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 1:
+            self._recent.popleft()
+        if len(self._recent) >= self.limit_per_second:
+            self.retry_after_count += 1
+            raise RetryAfter(1)
+        if self.timeout_every and self.calls % self.timeout_every == 0:
+            raise TimedOut()
+        self._recent.append(now)
+        self.delivered.add(chat_id)
+
+def bench_broadcast(work_dir: str):
+    """Пропускная способность рассылки на имитации Bot API"""
+    print("\n📊 Рассылка на имитации Bot API (лимит 30 сообщ./с, задержка 50 мс)")
+    logging.getLogger('broadcast').setLevel(logging.CRITICAL)
+    recipients = list(range(300))
+
+    async def sequential():
+        bot = FakeBot()
+        start = time.perf_counter()
+        for chat_id in recipients:
+            try:
+                await bot.send_message(chat_id=chat_id, text="test")
+            except Exception:
+                pass
+        return bot, time.perf_counter() - start, None
+
+    async def engine():
+        bot = FakeBot()
+        result = await BroadcastEngine(bot, progress_interval=60).send(recipients, "test")
+        return bot, result.elapsed, result
+
+    for name, scenario in (("последовательно", sequential), ("BroadcastEngine", engine)):
+        bot, elapsed, result = asyncio.run(scenario())
+        delivered = len(bot.delivered)
+        print(f"   {name:<16}: доставлено {delivered}/{len(recipients)} за {elapsed:5.1f}с "
+              f"({delivered / elapsed:5.1f} сообщ./с), RetryAfter: {bot.retry_after_count}"
+              + (f", повторов: {result.retries}" if result else ""))
+
+def measure_memory(func):
+    """Пиковая и удерживаемая результатом память (в байтах)"""
+    tracemalloc.start()
+    result = func()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak, retained
+
+def bench_streaming_clients(work_dir: str):
+    """Поиск клиентов одного пользователя: json.loads всего settings против потокового разбора"""
+    print("\n📊 Разбор settings: полный json.loads против потокового")
+    for count in (10000, 50000):
+        db_path = os.path.join(work_dir, f"streaming_{count}.db")
+        create_test_database(db_path, count)
+        conn = sqlite3.connect(db_path)
+        settings_text = conn.execute("SELECT settings FROM inbounds").fetchone()[0]
+        conn.close()
+        tg_id = 100000
+
+        loaders = (
+            ("json.loads + фильтр", lambda: [c for c in json.loads(settings_text)['clients'] if c.get('tgId') == tg_id]),
+            ("поток + фильтр", lambda: [c for c in iter_json_clients(settings_text) if c.get('tgId') == tg_id]),
+            ("json.loads (снимок)", lambda: json.loads(settings_text)),
+            ("поток компактно (снимок)", lambda: load_settings_compact(settings_text)),
+        )
+        print(f"   {count} клиентов, settings {len(settings_text) / 1024 ** 2:.1f} МБ:")
+        for name, loader in loaders:
+            elapsed = measure(loader)
+            peak, retained = measure_memory(loader)
+            print(f"      {name:<26}: {elapsed * 1000:7.1f} мс, пик {peak / 1024 ** 2:6.1f} МБ, "
+                  f"удерживается {retained / 1024 ** 2:6.1f} МБ")
+
+def bench_json1_menu(work_dir: str):
+    """Данные меню пользователя: кеш снимков в Python против запроса JSON1 в SQLite"""
+    print("\n📊 Данные меню: Python (кеш снимков) против JSON1")
+    for count in (1000, 10000, 100000):
+        db_path = os.path.join(work_dir, f"json1_{count}.db")
+        create_test_database(db_path, count)
+        tg_id = 100000
+
+        def python_cold():
+            db = DatabaseManager(db_path)
+            db.get_user_menu_data(tg_id)
+
+        python_db = DatabaseManager(db_path)
+        python_db.get_user_menu_data(tg_id)
+        json1_db = DatabaseManager(db_path)
+        json1_db.query_mode = 'json1'
+        json1_db.get_user_menu_data(tg_id)
+
+        warm = measure(lambda: python_db.get_user_menu_data(tg_id))
+        cold = measure(python_cold)
+        json1 = measure(lambda: json1_db.get_user_menu_data(tg_id))
+        print(f"   {count:>6} клиентов: Python с кешем {warm * 1000:8.2f} мс, Python без кеша {cold * 1000:8.1f} мс, "
+              f"JSON1 {json1 * 1000:8.1f} мс")
+
+def bench_client_records(work_dir: str):
+    """Память снимка: клиенты как словари из json.loads против записей Client со __slots__"""
+    print("\n📊 Память клиентов в снимке: dict против Client")
+    for count in (10000, 50000):
+        db_path = os.path.join(work_dir, f"records_{count}.db")
+        create_test_database(db_path, count, tg_users_count=count // 2)
+        conn = sqlite3.connect(db_path)
+        settings_text = conn.execute("SELECT settings FROM inbounds").fetchone()[0]
+        conn.close()
+
+        loaders = (
+            ("словари (json.loads)", lambda: json.loads(settings_text)['clients']),
+            ("записи Client", lambda: [Client.from_dict(c) for c in json.loads(settings_text)['clients']]),
+        )
+        print(f"   {count} клиентов:")
+        for name, loader in loaders:
+            elapsed = measure(loader)
+            _, retained = measure_memory(loader)
+            print(f"      {name:<22}: {elapsed * 1000:7.1f} мс, удерживается {retained / 1024 ** 2:6.1f} МБ "
+                  f"({retained / count:5.0f} байт на клиента)")
+
+        db = DatabaseManager(db_path)
+        elapsed = measure(lambda: DatabaseManager(db_path).get_snapshot())
+        _, retained = measure_memory(db.get_snapshot)
+        print(f"      {'снимок с индексами':<22}: {elapsed * 1000:7.1f} мс, удерживается {retained / 1024 ** 2:6.1f} МБ")
+
+def bench_vless_render(work_dir: str):
+    """Рендер VLESS ссылок: сборка шаблона на каждого клиента против скомпилированного шаблона"""
+    print("\n📊 Рендер 100000 VLESS ссылок")
+    db_path = os.path.join(work_dir, "vless.db")
+    create_test_database(db_path, 1000)
+    db = DatabaseManager(db_path)
+    inbound_data = db.get_inbound_data()
+    clients = [Client(str(uuid.uuid4()), f"client_{i}@test.com", flow='xtls-rprx-vision' if i % 2 else '')
+               for i in range(100000)]
+
+    per_client = measure(lambda: [db.build_vless_template(inbound_data).render(c) for c in clients])
+    template = db.build_vless_template(inbound_data)
+    compiled = measure(lambda: [template.render(c) for c in clients])
+    print(f"   Шаблон на каждого клиента: {per_client * 1000:7.1f} мс ({per_client / len(clients) * 1e6:.2f} мкс/ссылка)")
+    print(f"   Скомпилированный шаблон:   {compiled * 1000:7.1f} мс ({compiled / len(clients) * 1e6:.2f} мкс/ссылка)")
+
+def bench_menu_render(work_dir: str):
+    """Путь отрисовки меню: выборка данных, модель, текст и клавиатура"""
+    print("\n📊 Отрисовка меню пользователя (10000 клиентов в БД)")
+
+    def render_cold(view):
+        body, footer = render_menu_text.__wrapped__(view)
+        render_menu_keyboard.__wrapped__(view)
+        return body + footer
+
+    tg_id = 100000
+    for devices in (1, 10, 100):
+        db_path = os.path.join(work_dir, f"menu_{devices}.db")
+        create_test_database(db_path, 10000, tg_users_count=10000 // devices)
+        db = DatabaseManager(db_path)
+        menu_data = db.get_user_menu_data(tg_id)
+        view = build_menu_view(menu_data, is_admin=False)
+        render_menu(view)
+
+        fetch = measure(lambda: db.get_user_menu_data(tg_id), repeat=20)
+        build = measure(lambda: build_menu_view(menu_data, is_admin=False), repeat=20)
+        cold = measure(lambda: render_cold(view), repeat=20)
+        warm = measure(lambda: render_menu(view), repeat=20)
+        print(f"   {len(menu_data):>3} устройств: выборка {fetch * 1000:6.2f} мс, модель {build * 1e6:7.1f} мкс, "
+              f"отрисовка {cold * 1e6:7.1f} мкс, из кеша {warm * 1e6:5.1f} мкс")
+
+def legacy_database_hash(db_path: str) -> str:
+    """Прежний get_database_hash: конкатенация всех строк в одну Python-строку"""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    inbound_rows = conn.execute("SELECT settings, listen, port, remark, stream_settings FROM inbounds WHERE enable = 1 ORDER BY id").fetchall()
+    traffic_rows = conn.execute("SELECT email, up, down FROM client_traffics").fetchall()
+    conn.close()
+
+    data_string = ""
+    for inbound_row in inbound_rows:
+        data_string += f"inbound:{inbound_row['settings']}:{inbound_row['listen']}:{inbound_row['port']}:{inbound_row['remark']}:{inbound_row['stream_settings']}"
+    for row in traffic_rows:
+        data_string += f"traffic:{row['email']}:{row['up']}:{row['down']}"
+    return hashlib.md5(data_string.encode('utf-8')).hexdigest()
+
+def bench_database_digest(work_dir: str):
+    """Хеш состояния БД: конкатенация строк против потокового хеширования пачками"""
+    print("\n📊 Хеш состояния БД (100000 строк client_traffics)")
+    db_path = os.path.join(work_dir, "digest.db")
+    create_test_database(db_path, 100000)
+    db = DatabaseManager(db_path)
+
+    def query_digest(query: str):
+        with db.get_connection() as conn:
+            return db._digest_query(conn, query)
+
+    variants = (
+        ("конкатенация (прежний)", lambda: legacy_database_hash(db_path)),
+        ("потоково, оба хеша", db.get_database_digests),
+        ("потоково, только config", lambda: query_digest(CONFIG_DIGEST_QUERY)),
+        ("потоково, только traffic", lambda: query_digest(TRAFFIC_DIGEST_QUERY)),
+        ("сводка трафика (/stats)", db.get_traffic_summary),
+    )
+    for name, func in variants:
+        elapsed = measure(func)
+        peak, _ = measure_memory(func)
+        print(f"   {name:<26}: {elapsed * 1000:7.1f} мс, пик памяти {peak / 1024 ** 2:6.1f} МБ")
+
+def bench_traffic_history(work_dir: str):
+    """История трафика: запись замера всех клиентов и выборка за период по пользователю"""
+    print("\n📊 История трафика (замеры каждые 5 минут)")
+    store = TrafficHistoryStore(os.path.join(work_dir, "history.db"))
+    now = int(time.time())
+    step = 300
+    samples_per_email = 7 * 86400 // step
+
+    # Неделя замеров для 1000 клиентов
+    emails = [f"client_{i}@test.com" for i in range(1000)]
+    with store._conn:
+        store._conn.executemany(
+            "INSERT INTO traffic_samples (email, ts, up, down) VALUES (?, ?, ?, ?)",
+            ((email, now - k * step, 1024 * k, 4096 * k) for email in emails for k in range(1, samples_per_email + 1))
+        )
+    print(f"   В истории {len(emails) * samples_per_email} приращений")
+
+    for clients in (1000, 10000, 50000):
+        counters = {f"client_{i}@test.com": (i * 1024, i * 4096) for i in range(clients)}
+        store.record(counters, now)
+        grown = {email: (up + 1, down + 1) for email, (up, down) in counters.items()}
+        elapsed = measure(lambda: store.record(grown, now + 1), repeat=1)
+        print(f"   Замер {clients:>6} клиентов: {elapsed * 1000:7.1f} мс")
+
+    user_emails = emails[:10]
+    today = measure(lambda: store.get_usage(user_emails, now - 86400), repeat=20)
+    week = measure(lambda: store.get_usage(user_emails, now - 7 * 86400), repeat=20)
+    print(f"   Трафик 10 устройств: за сутки {today * 1000:6.2f} мс, за неделю {week * 1000:6.2f} мс")
+    store.close()
+
+def bench_usage_chart(work_dir: str):
+    """График трафика: рендер PNG в процессе и через пул процессов"""
+    print("\n📊 Рендер графика трафика")
+    for days in (14, 90):
+        buckets = [(f"{day:02d}.10", day * 300 * 1024 ** 2, day * 900 * 1024 ** 2) for day in range(days)]
+        elapsed = measure(lambda: render_usage_chart(buckets, "bench"))
+
+        async def via_pool():
+            renderer = ChartRenderer()
+            await renderer.render(buckets, "bench")  # Запуск процесса не учитываем
+            started = time.perf_counter()
+            for _ in range(5):
+                await renderer.render(buckets, "bench")
+            renderer.shutdown()
+            return (time.perf_counter() - started) / 5
+
+        pooled = asyncio.run(via_pool())
+        print(f"   {days:>3} дней: в процессе {elapsed * 1000:6.1f} мс, через пул {pooled * 1000:6.1f} мс")
+
+def bench_admin_stats(work_dir: str):
+    """Сводная статистика /stats: загрузка колонок, расчет и повторный запрос из кеша"""
+    print("\n📊 Статистика трафика /stats (100000 клиентов)")
+    db_path = os.path.join(work_dir, "stats.db")
+    create_test_database(db_path, 100000)
+    # Каждому десятому клиенту квота чуть больше потраченного
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE client_traffics SET total = (up + down) * 105 / 100 WHERE id % 10 = 0")
+    conn.commit()
+    conn.close()
+    db = DatabaseManager(db_path)
+
+    load = measure(lambda: TrafficColumns.load(db))
+    columns = TrafficColumns.load(db)
+    compute = measure(lambda: compute_traffic_stats(columns))
+    print(f"   Загрузка колонок: {load * 1000:7.1f} мс, расчет: {compute * 1000:7.1f} мс")
+
+    engine = TrafficStatsEngine(db)
+    first = measure(engine.get_stats, repeat=1)
+    cached = measure(engine.get_stats, repeat=20)
+    print(f"   get_stats: первый {first * 1000:7.1f} мс, из кеша {cached * 1000:7.3f} мс")
+
+    # Изменились только inbound: файл другой, сводка трафика та же
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE inbounds SET remark = 'changed'")
+    conn.commit()
+    conn.close()
+    revalidated = measure(engine.get_stats, repeat=1)
+    print(f"   get_stats после изменения inbound: {revalidated * 1000:7.1f} мс "
+          f"(попаданий {engine.stats['hits']}, пересчетов {engine.stats['misses']})")
+
+def bench_alert_scheduler(work_dir: str):
+    """Планировщик предупреждений: построение очереди, обработка событий и пересинхронизация"""
+    print("\n📊 Планировщик предупреждений (100000 клиентов)")
+    now = time.time()
+    gb = 1024 ** 3
+    clients = [
+        Client(id=str(i), email=f"client_{i}@test.com", tg_id=100000 + i, total=10 * gb,
+               expiry_time=int((now + (i % 60) * 86400 + 3600) * 1000))
+        for i in range(100000)
+    ]
+    # Расход от 0 до 10 GB, скорость - до 1 GB в сутки
+    usage = {client.email: (0, (i % 100) * gb // 10) for i, client in enumerate(clients)}
+    recent = {client.email: (0, (i % 10) * gb // 10) for i, client in enumerate(clients)}
+
+    scheduler = AlertScheduler(AlertStore(os.path.join(work_dir, "alerts.db")))
+    started = time.perf_counter()
+    scheduler.sync(1, clients, now)
+    print(f"   Построение очереди: {(time.perf_counter() - started) * 1000:7.1f} мс, событий {len(scheduler)}")
+
+    started = time.perf_counter()
+    notices = 0
+    while True:
+        due = scheduler.pop_due(now)
+        if not due:
+            break
+        quota_emails = [client.email for kind, client in due if kind == QUOTA]
+        batch_usage = {email: usage[email] for email in quota_emails}
+        batch_recent = {email: recent[email] for email in quota_emails}
+        notices += len(scheduler.handle(due, batch_usage, batch_recent, now))
+    print(f"   Первичная проверка: {(time.perf_counter() - started) * 1000:7.1f} мс, предупреждений {notices}")
+
+    next_due = measure(scheduler.next_due, repeat=1000)
+    print(f"   Ближайшее событие через {(scheduler.next_due() - now) / 60:.0f} мин, "
+          f"поиск {next_due * 1e6:.2f} мкс (без прохода по клиентам)")
+
+    # Изменился 1% клиентов: пересоздаются только их события
+    changed = [Client(id=c.id, email=c.email, tg_id=c.tg_id, total=c.total * 2, expiry_time=c.expiry_time)
+               if i % 100 == 0 else c for i, c in enumerate(clients)]
+    started = time.perf_counter()
+    rescheduled = scheduler.sync(2, changed, now)
+    print(f"   Пересинхронизация: {(time.perf_counter() - started) * 1000:7.1f} мс, изменилось клиентов {rescheduled}")
+    scheduler.store.close()
+
+BENCHMARKS = {
+    'configs': bench_user_configs,
+    'traffic': bench_traffic_stats,
+    'locked': bench_locked_database,
+    'broadcast': bench_broadcast,
+    'streaming': bench_streaming_clients,
+    'json1': bench_json1_menu,
+    'records': bench_client_records,
+    'vless': bench_vless_render,
+    'menu': bench_menu_render,
+    'digest': bench_database_digest,
+    'history': bench_traffic_history,
+    'chart': bench_usage_chart,
+    'stats': bench_admin_stats,
+    'alerts': bench_alert_scheduler,
+}
+
+def main():
+    """Основная функция"""
+    print("⏱️ Бенчмарки 3x-ui helper bot")
+    print("=" * 50)
+
+    names = sys.argv[1:] or list(BENCHMARKS)
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in names:
+            if name not in BENCHMARKS:
+                print(f"❌ Неизвестный бенчмарк: {name}. Доступны: {', '.join(BENCHMARKS)}")
+                continue
+            BENCHMARKS[name](work_dir)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,26 @@
 import os
+import time
 import logging
 import asyncio
-from datetime import datetime
-from typing import Dict, Any, Optional
+from functools import partial
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, MessageHandler, 
     ConversationHandler, ContextTypes, filters
 )
 from dotenv import load_dotenv
-from database import DatabaseManager
+from database import Client, DatabaseManager, AsyncDatabaseManager, LRUCache
+from watcher import DatabaseWatcher
+from broadcast import BroadcastEngine, BroadcastResult
+from storage import AlertStore, BroadcastStore, FileIdStore, TrafficHistoryStore, TRAFFIC_SAMPLE_INTERVAL
+from qr import QRRenderer, content_hash
+from menu import MenuCache, MenuView, build_menu_view, render_menu
+from charts import ChartRenderer, CHART_DAYS
+from stats import TrafficStatsEngine, STATS_TOP_N
+from alerts import AlertNotice, AlertScheduler, ALERT_RATE_WINDOW, QUOTA, format_alert
 
 # Загружаем переменные окружения из .env файла
 load_dotenv()
@@ -41,13 +52,43 @@ if ADMIN_IDS_STR:
     except ValueError:
         logger.warning("Ошибка при парсинге ADMIN_IDS. Рассылка будет недоступна.")
 
-# Инициализируем менеджер БД
+# Инициализируем менеджер БД и асинхронную обертку для обработчиков
 db_manager = DatabaseManager()
+async_db = AsyncDatabaseManager(db_manager)
+
+# Персистентная очередь рассылок и флаги отмены запущенных заданий
+broadcast_store = BroadcastStore()
+cancelled_broadcasts = set()
+
+# Рендер QR кодов конфигов (пул процессов, кеш PNG)
+qr_renderer = QRRenderer()
+
+# file_id загруженных медиа: повторная отправка без загрузки файла
+file_id_store = FileIdStore()
+
+# Рендер графиков трафика (пул процессов, метрики времени генерации)
+chart_renderer = ChartRenderer()
+
+# История трафика клиентов (замеры client_traffics в собственной БД бота)
+traffic_history = TrafficHistoryStore()
+
+# Сводная статистика трафика для /stats (пересчитывается только при изменении трафика)
+stats_engine = TrafficStatsEngine(db_manager)
+
+# Предупреждения о квоте и окончании подписки: очередь событий и отметки отправленных
+alert_store = AlertStore()
+alert_scheduler = AlertScheduler(alert_store)
+# Будит планировщик предупреждений при изменении клиентов
+alerts_wakeup = asyncio.Event()
+
+# Кеш моделей меню по user_id: короткий TTL, сбрасывается при изменении клиентов или трафика
+menu_cache = MenuCache()
+# Содержимое меню в отправленных сообщениях (chat_id, message_id), чтобы не редактировать их без изменений
+shown_menus = LRUCache(int(os.getenv('SHOWN_MENUS_CACHE_SIZE', '4096')))
 
 # Глобальные переменные для мониторинга
 monitoring_active = False
-last_configs = {}
-last_clients = []
+last_fingerprints = {}
 
 # Состояния для ConversationHandler - используем разные диапазоны для разных диалогов
 # Рассылка: 10-19
@@ -74,7 +115,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = user.id
     
     # Проверяем авторизацию
-    if db_manager.is_user_authorized(user_id):
+    if await async_db.is_user_authorized(user_id):
         await show_menu(update, context)
     else:
         welcome_message = f"Привет, {user.first_name}! 👋\n\n"
@@ -88,204 +129,303 @@ async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /menu"""
     user_id = update.effective_user.id
     
-    if not db_manager.is_user_authorized(user_id):
+    if not await async_db.is_user_authorized(user_id):
         await update.message.reply_text("❌ Вы не авторизованы. Обратитесь к администратору.")
         return
     
     await show_menu(update, context)
 
-async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Показать меню с информацией о клиентах"""
-    user_id = update.effective_user.id
-    menu_data = db_manager.get_user_menu_data(user_id)
+async def build_menu(user_id: int) -> Optional[MenuView]:
+    """Получить модель меню пользователя (из кеша или одним пакетным запросом к БД)"""
+    view = menu_cache.get(user_id)
+    if view is None:
+        menu_data = await async_db.get_user_menu_data(user_id)
+        if not menu_data:
+            return None
+        usage = await get_menu_usage([client_data['email'] for client_data in menu_data])
+        view = build_menu_view(menu_data, is_admin(user_id), usage)
+        menu_cache.put(user_id, view)
+    return view
+
+async def get_menu_usage(emails: List[str]) -> Dict[str, Tuple[float, float]]:
+    """Трафик клиентов за сегодня и за текущую неделю в GB (по истории замеров)
     
-    if not menu_data:
-        await update.message.reply_text("❌ Клиенты не найдены.")
+    Клиенты без точки отсчета в истории не попадают в результат - в меню для них нет строки
+    """
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = today - timedelta(days=today.weekday())
+    try:
+        tracked = await asyncio.to_thread(traffic_history.get_tracked, emails)
+        if not tracked:
+            return {}
+        today_usage = await asyncio.to_thread(traffic_history.get_usage, emails, today.timestamp())
+        week_usage = await asyncio.to_thread(traffic_history.get_usage, emails, week_start.timestamp())
+    except Exception as e:
+        logger.error(f"Ошибка чтения истории трафика: {e}")
+        return {}
+    
+    usage = {}
+    for email in emails:
+        if email not in tracked:
+            continue
+        today_up, today_down = today_usage.get(email, (0, 0))
+        week_up, week_down = week_usage.get(email, (0, 0))
+        usage[email] = (db_manager.bytes_to_gb(today_up + today_down), db_manager.bytes_to_gb(week_up + week_down))
+    return usage
+
+async def record_traffic_history() -> None:
+    """Периодически сохранять счетчики трафика всех клиентов в историю (x-ui.db только читается)"""
+    logger.info(f"Запуск записи истории трафика (интервал {TRAFFIC_SAMPLE_INTERVAL:.0f}с)")
+    while monitoring_active:
+        try:
+            counters = await async_db.run(db_manager.get_all_traffic_stats, default={})
+            if counters:
+                recorded = await asyncio.to_thread(traffic_history.record, counters)
+                logger.debug(f"Записано приращений трафика: {recorded}")
+        except Exception as e:
+            logger.error(f"Ошибка записи истории трафика: {e}")
+        await asyncio.sleep(TRAFFIC_SAMPLE_INTERVAL)
+
+async def run_alerts(bot) -> None:
+    """Отправлять предупреждения о квоте и сроке подписки, просыпаясь только к ближайшему событию"""
+    logger.info("Запуск планировщика предупреждений")
+    while monitoring_active:
+        alerts_wakeup.clear()
+        try:
+            snapshot = await async_db.run(db_manager.get_snapshot, default=None)
+            if snapshot is not None and snapshot.version != alert_scheduler.version:
+                changed = await asyncio.to_thread(alert_scheduler.sync, snapshot.version, snapshot.clients, time.time())
+                logger.debug(f"Расписание предупреждений обновлено для {changed} клиентов")
+            
+            due = alert_scheduler.pop_due(time.time())
+            if due:
+                await process_alerts(bot, due)
+                continue
+        except Exception as e:
+            logger.error(f"Ошибка планировщика предупреждений: {e}")
+            await asyncio.sleep(5)
+            continue
+        
+        # Спим до ближайшего события или до изменения клиентов
+        next_due = alert_scheduler.next_due()
+        timeout = max(next_due - time.time(), 0) if next_due is not None else None
+        try:
+            await asyncio.wait_for(alerts_wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+async def process_alerts(bot, due: List[Tuple[str, Client]]) -> None:
+    """Проверить наступившие события и разослать предупреждения клиентам и администраторам"""
+    now = time.time()
+    emails = [client.email for kind, client in due if kind == QUOTA]
+    usage, recent = {}, {}
+    if emails:
+        try:
+            usage = await async_db.run(partial(db_manager.get_traffic_stats_many, emails, strict=True))
+            recent = await asyncio.to_thread(traffic_history.get_usage, emails, now - ALERT_RATE_WINDOW)
+        except Exception as e:
+            # Пустой результат при сбое выглядел бы как сброс счетчиков - проверки квоты переносим
+            logger.error(f"Ошибка чтения трафика для предупреждений: {e}")
+            alert_scheduler.postpone([event for event in due if event[0] == QUOTA], now)
+            due = [event for event in due if event[0] != QUOTA]
+    notices: List[AlertNotice] = await asyncio.to_thread(alert_scheduler.handle, due, usage, recent, now)
+    if not notices:
         return
     
-    # Объединяем информацию о всех клиентах в одно сообщение
-    messages = []
-    for client_data in menu_data:
-        email = client_data['email']
-        
-        if client_data['traffic_stats']:
-            message = f"👤 **{email}**\n\n"
-            message += f"🔼 Исходящий трафик: ↑{round(client_data['up_gb'], 3)}GB\n"
-            message += f"🔽 Входящий трафик: ↓{round(client_data['down_gb'], 3)}GB\n"
-            message += f"📊 Всего: ↑↓{round(client_data['total_gb'], 3)}GB"
-        else:
-            message = f"👤 **{email}**\n\n"
-            message += "📊 Статистика трафика недоступна"
-        
-        messages.append(message)
+    # Отметки уже сохранены: при сбое отправки предупреждение не повторяется
+    for notice in notices:
+        tg_id = notice.client.tg_id
+        if not tg_id:
+            continue
+        try:
+            await bot.send_message(chat_id=tg_id, text=format_alert(notice))
+            logger.info(f"Отправлено предупреждение {notice.kind}/{notice.stage} для {notice.client.email} (TG ID: {tg_id})")
+        except Exception as e:
+            logger.error(f"Ошибка отправки предупреждения для {tg_id}: {e}")
     
-    # Объединяем все сообщения
-    full_message = "\n\n".join(messages)
+    # Администраторам - одна сводка на пачку событий
+    lines = ["🔔 Предупреждения клиентам:"]
+    for notice in notices:
+        tg = f" (tgId {notice.client.tg_id})" if notice.client.tg_id else " (без tgId)"
+        lines.append(f"\n{format_alert(notice).splitlines()[0]}{tg}")
     
-    # Добавляем время обновления в конце
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    full_message += f"\n\n📋🔄 Обновлено: {current_time}"
+    text = "\n".join(lines)
+    chunks = [text[start:start + 4000] for start in range(0, len(text), 4000)]
+    for admin_id in ADMIN_IDS:
+        for chunk in chunks:
+            try:
+                await bot.send_message(chat_id=admin_id, text=chunk)
+            except Exception as e:
+                logger.error(f"Ошибка отправки сводки предупреждений администратору {admin_id}: {e}")
+                break
+
+def is_menu_shown(chat_id: int, message_id: int, view: MenuView) -> bool:
+    """Проверить, показано ли в сообщении то же меню (без учета времени обновления)"""
+    return shown_menus.get((chat_id, message_id)) == view
+
+def remember_shown_menu(chat_id: int, message_id: int, view: MenuView):
+    """Запомнить, какое меню показано в сообщении"""
+    shown_menus.put((chat_id, message_id), view)
+
+def forget_shown_menu(chat_id: int, message_id: int):
+    """Сообщение с меню отредактировано во что-то другое - меню в нем больше нет"""
+    shown_menus.put((chat_id, message_id), None)
+
+async def invalidate_menu_cache():
+    """Сбросить кеш меню пользователей, у которых изменился трафик, и устаревшие записи"""
+    menu_cache.prune()
+    if not len(menu_cache):
+        return
     
-    # Добавляем информацию о команде /report
-    full_message += f"\n\n📝 Используйте /report для сообщения о проблемах"
+    traffic = await async_db.run(db_manager.get_traffic_stats_many, menu_cache.emails(), default={})
+    menu_cache.drop_changed(traffic)
+
+async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показать меню с информацией о клиентах"""
+    view = await build_menu(update.effective_user.id)
     
-    # Добавляем админские команды для администраторов
-    if is_admin(user_id):
-        full_message += f"\n\n🔐 **Админские команды:**\n"
-        full_message += f"📢 /mail - рассылка сообщений всем пользователям\n"
-        full_message += f"📝 /report - создание отчета о проблеме"
+    if not view:
+        await update.message.reply_text("❌ Клиенты не найдены.")
+        return
     
-    # Создаем кнопки для первого клиента (если есть)
-    if menu_data:
-        first_email = menu_data[0]['email']
-        keyboard = [
-            [InlineKeyboardButton("📄 Мой конфиг", callback_data=f"config_{first_email}")],
-            [InlineKeyboardButton("🔄 Обновить", callback_data=f"refresh_{first_email}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(full_message, parse_mode='Markdown', reply_markup=reply_markup)
+    text, reply_markup = render_menu(view)
+    message = await update.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+    remember_shown_menu(message.chat_id, message.message_id, view)
 
 async def show_menu_from_callback(query, context: Optional[ContextTypes.DEFAULT_TYPE] = None) -> None:
     """Показать меню из callback query"""
-    user_id = query.from_user.id
-    menu_data = db_manager.get_user_menu_data(user_id)
+    view = await build_menu(query.from_user.id)
+    chat_id, message_id = query.message.chat_id, query.message.message_id
     
-    if not menu_data:
+    if not view:
         await query.edit_message_text("❌ Клиенты не найдены.")
+        forget_shown_menu(chat_id, message_id)
         return
     
-    # Объединяем информацию о всех клиентах в одно сообщение
-    messages = []
-    for client_data in menu_data:
-        email = client_data['email']
-        
-        if client_data['traffic_stats']:
-            message = f"👤 **{email}**\n\n"
-            message += f"🔼 Исходящий трафик: ↑{round(client_data['up_gb'], 3)}GB\n"
-            message += f"🔽 Входящий трафик: ↓{round(client_data['down_gb'], 3)}GB\n"
-            message += f"📊 Всего: ↑↓{round(client_data['total_gb'], 3)}GB"
-        else:
-            message = f"👤 **{email}**\n\n"
-            message += "📊 Статистика трафика недоступна"
-        
-        messages.append(message)
-    
-    # Объединяем все сообщения
-    full_message = "\n\n".join(messages)
-    
-    # Добавляем время обновления в конце
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    full_message += f"\n\n📋🔄 Обновлено: {current_time}"
+    text, reply_markup = render_menu(view)
     
-    # Добавляем информацию о команде /report
-    full_message += f"\n\n📝 Используйте /report для сообщения о проблемах"
-    
-    # Добавляем админские команды для администраторов
-    if is_admin(user_id):
-        full_message += f"\n\n🔐 **Админские команды:**\n"
-        full_message += f"📢 /mail - рассылка сообщений всем пользователям\n"
-        full_message += f"📝 /report - создание отчета о проблеме"
+    # Данные не изменились и в сообщении по-прежнему меню (его клавиатура) -
+    # edit_message_text вернул бы "message is not modified"
+    if is_menu_shown(chat_id, message_id, view) and query.message.reply_markup == reply_markup:
+        return
     
-    # Создаем кнопки для первого клиента (если есть)
-    if menu_data:
-        first_email = menu_data[0]['email']
-        keyboard = [
-            [InlineKeyboardButton("📄 Мой конфиг", callback_data=f"config_{first_email}")],
-            [InlineKeyboardButton("🔄 Обновить", callback_data=f"refresh_{first_email}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(full_message, parse_mode='Markdown', reply_markup=reply_markup)
+    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+    remember_shown_menu(chat_id, message_id, view)
 
 async def show_menu_by_user_id(bot, user_id: int, chat_id: int, edit_message_id: Optional[int] = None) -> None:
     """Показать меню по user_id (для использования после завершения диалогов)"""
     logger.info(f"[MENU] show_menu_by_user_id вызвана для user_id={user_id}, chat_id={chat_id}")
-    menu_data = db_manager.get_user_menu_data(user_id)
+    view = await build_menu(user_id)
     
-    logger.info(f"[MENU] Получено данных о клиентах: {len(menu_data) if menu_data else 0}")
-    
-    if not menu_data:
+    if not view:
         message_text = "❌ Клиенты не найдены."
         logger.warning(f"[MENU] Клиенты не найдены для пользователя {user_id}")
         if edit_message_id:
             try:
                 await bot.edit_message_text(chat_id=chat_id, message_id=edit_message_id, text=message_text)
+                forget_shown_menu(chat_id, edit_message_id)
             except:
                 await bot.send_message(chat_id=chat_id, text=message_text)
         else:
             await bot.send_message(chat_id=chat_id, text=message_text)
         return
     
-    # Объединяем информацию о всех клиентах в одно сообщение
-    messages = []
-    for client_data in menu_data:
-        email = client_data['email']
-        
-        if client_data['traffic_stats']:
-            message = f"👤 **{email}**\n\n"
-            message += f"🔼 Исходящий трафик: ↑{round(client_data['up_gb'], 3)}GB\n"
-            message += f"🔽 Входящий трафик: ↓{round(client_data['down_gb'], 3)}GB\n"
-            message += f"📊 Всего: ↑↓{round(client_data['total_gb'], 3)}GB"
-        else:
-            message = f"👤 **{email}**\n\n"
-            message += "📊 Статистика трафика недоступна"
-        
-        messages.append(message)
+    if edit_message_id and is_menu_shown(chat_id, edit_message_id, view):
+        return
     
-    # Объединяем все сообщения
-    full_message = "\n\n".join(messages)
+    text, reply_markup = render_menu(view)
     
-    # Добавляем время обновления в конце
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    full_message += f"\n\n📋🔄 Обновлено: {current_time}"
+    if edit_message_id:
+        try:
+            await bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=edit_message_id,
+                text=text,
+                parse_mode='Markdown',
+                reply_markup=reply_markup
+            )
+            remember_shown_menu(chat_id, edit_message_id, view)
+            return
+        except:
+            pass
     
-    # Добавляем информацию о команде /report
-    full_message += f"\n\n📝 Используйте /report для сообщения о проблемах"
+    try:
+        message = await bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            parse_mode='Markdown',
+            reply_markup=reply_markup
+        )
+        remember_shown_menu(chat_id, message.message_id, view)
+        logger.info(f"[MENU] Сообщение с меню успешно отправлено пользователю {user_id}")
+    except Exception as e:
+        logger.error(f"[MENU] Ошибка при отправке меню пользователю {user_id}: {e}")
+        raise
+
+async def send_media(bot, chat_id: int, kind: str, content_key: str, render: Callable[[], Awaitable[bytes]],
+                     caption: Optional[str] = None, reply_markup=None, filename: Optional[str] = None):
+    """Отправить фото или документ, переиспользуя file_id ранее загруженного файла
     
-    # Добавляем админские команды для администраторов
-    if is_admin(user_id):
-        full_message += f"\n\n🔐 **Админские команды:**\n"
-        full_message += f"📢 /mail - рассылка сообщений всем пользователям\n"
-        full_message += f"📝 /report - создание отчета о проблеме"
+    content_key - хеш данных, из которых рендерится файл; render вызывается только если
+    файл еще не загружался или Telegram отклонил сохраненный file_id
+    """
+    send = bot.send_photo if kind == 'photo' else bot.send_document
+    kwargs = {'chat_id': chat_id, 'caption': caption, 'reply_markup': reply_markup}
     
-    # Создаем кнопки для первого клиента (если есть)
-    if menu_data:
-        first_email = menu_data[0]['email']
-        keyboard = [
-            [InlineKeyboardButton("📄 Мой конфиг", callback_data=f"config_{first_email}")],
-            [InlineKeyboardButton("🔄 Обновить", callback_data=f"refresh_{first_email}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        if edit_message_id:
-            try:
-                await bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=edit_message_id,
-                    text=full_message,
-                    parse_mode='Markdown',
-                    reply_markup=reply_markup
-                )
-            except:
-                await bot.send_message(
-                    chat_id=chat_id,
-                    text=full_message,
-                    parse_mode='Markdown',
-                    reply_markup=reply_markup
-                )
-        else:
+    # Хранилище file_id - только кеш: его ошибки не должны мешать отправке
+    try:
+        file_id = await asyncio.to_thread(file_id_store.get, content_key)
+    except Exception as e:
+        logger.error(f"Ошибка чтения file_id ({kind}), загружаем файл: {e}")
+        file_id = None
+    if file_id:
+        try:
+            return await send(**{kind: file_id}, **kwargs)
+        except BadRequest as e:
+            logger.warning(f"Telegram не принял сохраненный file_id ({kind}), загружаем заново: {e}")
             try:
-                await bot.send_message(
-                    chat_id=chat_id,
-                    text=full_message,
-                    parse_mode='Markdown',
-                    reply_markup=reply_markup
-                )
-                logger.info(f"[MENU] Сообщение с меню успешно отправлено пользователю {user_id}")
+                await asyncio.to_thread(file_id_store.forget, content_key)
             except Exception as e:
-                logger.error(f"[MENU] Ошибка при отправке меню пользователю {user_id}: {e}")
-                raise
+                logger.error(f"Ошибка удаления file_id ({kind}): {e}")
+    
+    data = await render()
+    if kind == 'document' and filename:
+        kwargs['filename'] = filename
+    message = await send(**{kind: data}, **kwargs)
+    
+    uploaded = message.photo[-1] if kind == 'photo' else message.document
+    try:
+        await asyncio.to_thread(file_id_store.put, content_key, uploaded.file_id)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения file_id ({kind}): {e}")
+    return message
+
+async def send_config_qr(bot, chat_id: int, email: str, config: str) -> None:
+    """Отправить QR код конфига"""
+    await send_media(
+        bot, chat_id, 'photo', content_hash(f"qr:{config}"),
+        lambda: qr_renderer.render(config), caption=f"🔳 QR для {email}"
+    )
+
+async def send_usage_chart(bot, chat_id: int, user_id: int, emails: List[str]) -> None:
+    """Отправить график трафика пользователя по дням (по суточным суммам истории замеров)"""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    days = [today - timedelta(days=offset) for offset in range(CHART_DAYS - 1, -1, -1)]
+    usage = await asyncio.to_thread(traffic_history.get_daily_usage, emails, int(days[0].timestamp()))
+    
+    if not usage:
+        await bot.send_message(chat_id=chat_id, text="📈 История трафика пока пуста, график появится после первых замеров.")
+        return
+    
+    buckets = [(day.strftime("%d.%m"), *usage.get(int(day.timestamp()), (0, 0))) for day in days]
+    
+    # Ключ - пользователь, день и сами данные: пока не было нового замера, повторные нажатия
+    # отправляют сохраненный file_id без рендера и загрузки
+    await send_media(
+        bot, chat_id, 'photo', content_hash(f"chart:{user_id}:{today.date()}:{buckets}"),
+        lambda: chart_renderer.render(buckets, f"Traffic for the last {CHART_DAYS} days"),
+        caption=f"📈 Трафик за последние {CHART_DAYS} дней"
+    )
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик нажатий на кнопки (только для обычных кнопок, не связанных с диалогами)"""
@@ -298,28 +438,64 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         email = query.data.replace("config_", "")
         
         # Получаем все конфиги пользователя
-        user_clients = db_manager.get_user_clients(user_id)
+        user_clients = await async_db.get_user_clients(user_id)
         
         if not user_clients:
             await query.edit_message_text("❌ Клиенты не найдены.")
+            forget_shown_menu(query.message.chat_id, query.message.message_id)
             return
         
         # Формируем сообщение со всеми конфигами
         config_messages = []
-        for client in user_clients:
-            client_email = client.get('email', '')
-            config = db_manager.generate_vless_config(client)
+        configs = await async_db.generate_vless_configs(user_clients)
+        for client, config in zip(user_clients, configs):
+            client_email = client.email
             
             config_messages.append(f"📄 Твой конфиг для `{client_email}`:\n```\n{config}\n```")
         
         # Объединяем все конфиги
         full_message = "\n\n".join(config_messages)
         
-        # Создаем кнопку "Меню"
-        keyboard = [[InlineKeyboardButton("📋 Меню", callback_data="menu")]]
+        # Кнопка QR для каждого конфига и кнопка "Меню"
+        keyboard = [
+            [InlineKeyboardButton(f"🔳 QR {client.email}", callback_data=f"qr_{client.id}")]
+            for client in user_clients
+        ]
+        keyboard.append([InlineKeyboardButton("📋 Меню", callback_data="menu")])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(full_message, parse_mode='Markdown', reply_markup=reply_markup)
+        # Вместо меню в сообщении теперь конфиги: кнопка "Меню" должна его отредактировать
+        forget_shown_menu(query.message.chat_id, query.message.message_id)
+    
+    elif query.data.startswith("qr_"):
+        client_id = query.data.replace("qr_", "")
+        client = await async_db.get_client_by_id(client_id)
+        
+        # QR можно получить только для своего клиента (администратор - для любого)
+        if not client or (client.tg_id != user_id and not is_admin(user_id)):
+            await query.answer("Клиент не найден", show_alert=True)
+            return
+        
+        config = await async_db.generate_vless_config(client)
+        try:
+            await send_config_qr(context.bot, query.message.chat_id, client.email, config)
+        except Exception as e:
+            logger.error(f"Ошибка отправки QR для клиента {client.email} пользователю {user_id}: {e}")
+            await query.answer("Ошибка при генерации QR", show_alert=True)
+    
+    elif query.data == "chart":
+        user_clients = await async_db.get_user_clients(user_id)
+        
+        if not user_clients:
+            await query.answer("Клиенты не найдены", show_alert=True)
+            return
+        
+        try:
+            await send_usage_chart(context.bot, query.message.chat_id, user_id, [client.email for client in user_clients])
+        except Exception as e:
+            logger.error(f"Ошибка отправки графика пользователю {user_id}: {e}")
+            await query.answer("Ошибка при построении графика", show_alert=True)
     
     elif query.data.startswith("refresh_"):
         email = query.data.replace("refresh_", "")
@@ -362,20 +538,15 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.info(f"[ADMIN] Запрос конфига для клиента {client_id} от администратора {user_id}")
         
         # Находим клиента по ID
-        all_clients = db_manager.get_all_clients()
-        target_client = None
-        for client in all_clients:
-            if client.get('id') == client_id:
-                target_client = client
-                break
+        target_client = await async_db.get_client_by_id(client_id)
         
         if not target_client:
             await query.answer("Клиент не найден", show_alert=True)
             return
         
         # Генерируем конфиг
-        config = db_manager.generate_vless_config(target_client)
-        client_email = target_client.get('email', 'Неизвестно')
+        config = await async_db.generate_vless_config(target_client)
+        client_email = target_client.email or 'Неизвестно'
         
         # Убираем кнопку из сообщения
         try:
@@ -386,8 +557,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # Отправляем конфиг отдельным сообщением
         config_message = f"🔑 Конфиг для `{client_email}`:\n```\n{config}\n```"
         
+        keyboard = [[InlineKeyboardButton("🔳 QR", callback_data=f"qr_{target_client.id}")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
         try:
-            await query.message.reply_text(config_message, parse_mode='Markdown')
+            await query.message.reply_text(config_message, parse_mode='Markdown', reply_markup=reply_markup)
             logger.info(f"[ADMIN] Конфиг отправлен администратору {user_id} для клиента {client_email}")
         except Exception as e:
             logger.error(f"Ошибка отправки конфига администратору {user_id}: {e}")
@@ -457,7 +631,7 @@ async def mail_receive_message(update: Update, context: ContextTypes.DEFAULT_TYP
             logger.error(f"Ошибка при удалении кнопки отмены: {e}")
     
     # Получаем все уникальные telegram ID пользователей
-    telegram_ids = db_manager.get_all_unique_telegram_ids()
+    telegram_ids = await async_db.get_all_unique_telegram_ids()
     
     if not telegram_ids:
         await update.message.reply_text("❌ Не найдено пользователей для рассылки.")
@@ -514,33 +688,26 @@ async def mail_handle_confirm_button(update: Update, context: ContextTypes.DEFAU
             logger.error(f"[MAIL] Ошибка: данные рассылки не найдены для пользователя {user_id}")
             return END
         
-        # Выполняем рассылку
-        success_count = 0
-        failed_count = 0
-        
         # Формируем сообщение с подписью
         message_with_signature = f"⚫️ Тёмная Сторона сообщает:\n\n{mail_text}"
         
-        for tg_id in telegram_ids:
-            try:
-                await context.bot.send_message(
-                    chat_id=tg_id,
-                    text=message_with_signature
-                )
-                success_count += 1
-                logger.info(f"[MAIL] Сообщение успешно отправлено пользователю {tg_id}")
-            except Exception as e:
-                failed_count += 1
-                logger.error(f"[MAIL] Ошибка отправки сообщения пользователю {tg_id}: {e}")
-        
-        # Отправляем статистику администратору
-        stats_message = "✅ Рассылка завершена!\n\n"
-        stats_message += f"📊 Статистика:\n"
-        stats_message += f"✅ Успешно отправлено: {success_count}\n"
-        stats_message += f"❌ Ошибок: {failed_count}\n"
-        stats_message += f"📈 Всего пользователей: {len(telegram_ids)}"
+        # Сохраняем задание, чтобы рассылка продолжилась после перезапуска бота
+        try:
+            job_id = await asyncio.to_thread(
+                broadcast_store.create_job,
+                message_with_signature, user_id, query.message.chat_id, query.message.message_id, telegram_ids
+            )
+        except Exception as e:
+            logger.error(f"[MAIL] Не удалось сохранить задание рассылки от пользователя {user_id}: {e}")
+            await query.edit_message_text(
+                "❌ Не удалось поставить рассылку в очередь: хранилище бота недоступно.\n"
+                "Проверьте права на каталог данных (BOT_DATA_PATH) и попробуйте снова."
+            )
+            return END
         
-        await query.message.reply_text(stats_message)
+        # Рассылка может идти долго - выполняем ее в фоне, чтобы не блокировать обработку других обновлений
+        logger.info(f"[MAIL] Запуск рассылки #{job_id} от пользователя {user_id} на {len(telegram_ids)} получателей")
+        context.application.create_task(run_broadcast(context.bot, job_id))
         
         # Очищаем данные
         context.user_data.pop('mail_text', None)
@@ -549,11 +716,6 @@ async def mail_handle_confirm_button(update: Update, context: ContextTypes.DEFAU
         context.user_data.pop('mail_chat_id', None)
         context.user_data.pop('mail_confirm_message_id', None)
         
-        logger.info(f"[MAIL] Рассылка завершена для пользователя {user_id}: успешно {success_count}, ошибок {failed_count}")
-        
-        # Показываем главное меню
-        await show_menu_by_user_id(context.bot, user_id, query.message.chat_id)
-        
         return END
     
     elif callback_data == "mail_cancel_confirm":
@@ -576,6 +738,256 @@ async def mail_handle_confirm_button(update: Update, context: ContextTypes.DEFAU
     await query.answer("Неизвестная команда")
     return MAIL_CONFIRM
 
+def format_broadcast_progress(job_id: int, counts: Dict[str, int], result: BroadcastResult) -> str:
+    """Сформировать текст прогресса рассылки"""
+    total = sum(counts.values())
+    sent = counts.get('sent', 0) + result.sent
+    failed = counts.get('failed', 0) + result.failed
+    unknown = counts.get('unknown', 0)
+    
+    message = f"⏳ Рассылка #{job_id}: {sent + failed + unknown}/{total}\n\n"
+    message += f"✅ Отправлено: {sent}\n"
+    message += f"❌ Ошибок: {failed}\n"
+    if unknown:
+        message += f"❔ Неизвестно (прервано перезапуском): {unknown}\n"
+    message += f"⚡️ Скорость: {result.rate:.1f} сообщ./с"
+    return message
+
+async def run_broadcast(bot, job_id: int) -> None:
+    """Выполнить (или продолжить) рассылку из очереди с обновлением статуса у администратора"""
+    job = await asyncio.to_thread(broadcast_store.get_job, job_id)
+    if not job:
+        logger.error(f"[MAIL] Рассылка #{job_id} не найдена")
+        return
+    
+    user_id = job['admin_id']
+    chat_id = job['chat_id']
+    status_message_id = job['status_message_id']
+    
+    # Статусы на момент запуска: при возобновлении часть получателей уже обработана
+    counts = await asyncio.to_thread(broadcast_store.get_job_counts, job_id)
+    telegram_ids = await asyncio.to_thread(broadcast_store.get_pending_recipients, job_id)
+    
+    async def update_progress(result: BroadcastResult):
+        if status_message_id:
+            await bot.edit_message_text(chat_id=chat_id, message_id=status_message_id,
+                                        text=format_broadcast_progress(job_id, counts, result))
+    
+    # Статус каждого получателя - коммит в bot.db, выполняем вне event loop
+    async def mark_sending(tg_id: int):
+        await asyncio.to_thread(broadcast_store.mark_sending, job_id, tg_id)
+    
+    async def mark_result(tg_id: int, success: bool, error: Optional[str]):
+        await asyncio.to_thread(broadcast_store.mark_result, job_id, tg_id, success, error)
+    
+    engine = BroadcastEngine(bot)
+    result = await engine.send(
+        telegram_ids,
+        job['text'],
+        progress_callback=update_progress,
+        on_sending=mark_sending,
+        on_result=mark_result,
+        should_stop=lambda: job_id in cancelled_broadcasts
+    )
+    
+    cancelled = job_id in cancelled_broadcasts
+    cancelled_broadcasts.discard(job_id)
+    await asyncio.to_thread(broadcast_store.finish_job, job_id, 'cancelled' if cancelled else 'done')
+    
+    try:
+        await update_progress(result)
+    except Exception as e:
+        logger.error(f"[MAIL] Ошибка обновления прогресса рассылки: {e}")
+    
+    # Отправляем статистику администратору
+    final_counts = await asyncio.to_thread(broadcast_store.get_job_counts, job_id)
+    stats_message = f"🛑 Рассылка #{job_id} отменена\n\n" if cancelled else f"✅ Рассылка #{job_id} завершена!\n\n"
+    stats_message += f"📊 Статистика:\n"
+    stats_message += f"✅ Успешно отправлено: {final_counts.get('sent', 0)}\n"
+    stats_message += f"❌ Ошибок: {final_counts.get('failed', 0)}\n"
+    if final_counts.get('unknown'):
+        stats_message += f"❔ Неизвестно: {final_counts['unknown']}\n"
+    if final_counts.get('pending'):
+        stats_message += f"⏸️ Не отправлено: {final_counts['pending']}\n"
+    stats_message += f"📈 Всего пользователей: {sum(final_counts.values())}\n"
+    stats_message += f"⏱️ Время: {result.elapsed:.1f}с"
+    
+    await bot.send_message(chat_id=chat_id, text=stats_message)
+    
+    logger.info(f"[MAIL] Рассылка #{job_id} завершена для пользователя {user_id}: успешно {result.sent}, ошибок {result.failed}, повторов {result.retries}")
+    
+    # Показываем главное меню
+    await show_menu_by_user_id(bot, user_id, chat_id)
+
+async def resume_broadcasts(application: Application) -> None:
+    """Продолжить рассылки, прерванные перезапуском бота"""
+    for job in await asyncio.to_thread(broadcast_store.get_running_jobs):
+        await asyncio.to_thread(broadcast_store.mark_interrupted, job['id'])
+        logger.info(f"[MAIL] Возобновление рассылки #{job['id']}")
+        application.create_task(run_broadcast(application.bot, job['id']))
+
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /jobs - список последних рассылок"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Извините, у вас нет прав на выполнение этой команды.")
+        return
+    
+    jobs = await asyncio.to_thread(broadcast_store.get_recent_jobs)
+    if not jobs:
+        await update.message.reply_text("📭 Рассылок еще не было.")
+        return
+    
+    status_icons = {'running': '⏳', 'done': '✅', 'cancelled': '🛑'}
+    lines = ["📋 Последние рассылки:\n"]
+    for job in jobs:
+        counts = await asyncio.to_thread(broadcast_store.get_job_counts, job['id'])
+        created = datetime.fromtimestamp(job['created_at']).strftime("%Y-%m-%d %H:%M")
+        lines.append(
+            f"{status_icons.get(job['status'], '❔')} #{job['id']} от {created}: "
+            f"отправлено {counts.get('sent', 0)}/{sum(counts.values())}, ошибок {counts.get('failed', 0)}"
+        )
+    lines.append("\n🛑 /canceljob <номер> - отменить рассылку")
+    
+    await update.message.reply_text("\n".join(lines))
+
+async def cancel_job_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /canceljob <номер> - отмена запущенной рассылки"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Извините, у вас нет прав на выполнение этой команды.")
+        return
+    
+    try:
+        job_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("❌ Укажите номер рассылки: /canceljob <номер>")
+        return
+    
+    job = await asyncio.to_thread(broadcast_store.get_job, job_id)
+    if not job or job['status'] != 'running':
+        await update.message.reply_text(f"❌ Рассылка #{job_id} не найдена или уже завершена.")
+        return
+    
+    # Запущенная задача увидит флаг и завершит задание со статусом cancelled
+    cancelled_broadcasts.add(job_id)
+    logger.info(f"[MAIL] Рассылка #{job_id} отменена администратором {user_id}")
+    await update.message.reply_text(f"🛑 Рассылка #{job_id} будет остановлена.")
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /metrics - статистика кешей и пула соединений"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Извините, у вас нет прав на выполнение этой команды.")
+        return
+    
+    config_stats = db_manager.get_config_cache_stats()
+    snapshot_stats = db_manager.get_cache_stats()
+    pool_stats = db_manager.get_pool_stats()
+    
+    lines = ["📊 Метрики бота:\n"]
+    lines.append(
+        f"🔑 Кеш конфигов: {config_stats['size']}/{config_stats['max_size']}, "
+        f"попаданий {config_stats['hits']}, промахов {config_stats['misses']} "
+        f"({config_stats['hit_rate']:.0%}), вытеснено {config_stats['evictions']}"
+    )
+    lines.append(
+        f"🗂 Снимок inbound: версия {snapshot_stats['version']}, inbound {snapshot_stats['inbounds']}, "
+        f"попаданий {snapshot_stats['hits']}, перечитываний {snapshot_stats['misses']}, "
+        f"без изменений {snapshot_stats['revalidations']}, разобрано inbound {snapshot_stats['parsed_inbounds']}"
+    )
+    lines.append(
+        f"🔌 Пул соединений: открыто {pool_stats['opened']}, переиспользовано {pool_stats['reused']}, "
+        f"закрыто {pool_stats['closed']}, простаивает {pool_stats['idle']}"
+    )
+    lines.append(
+        f"📋 Кеш меню: {len(menu_cache)} пользователей, попаданий {menu_cache.stats['hits']}, "
+        f"промахов {menu_cache.stats['misses']}, сброшено {menu_cache.stats['invalidations']}"
+    )
+    qr_stats = qr_renderer.get_stats()
+    lines.append(
+        f"🔳 Кеш QR: {qr_stats['size']}/{qr_stats['max_size']}, попаданий {qr_stats['hits']}, "
+        f"промахов {qr_stats['misses']}"
+    )
+    chart_stats = chart_renderer.get_stats()
+    lines.append(
+        f"📈 Графики: построено {chart_stats['renders']}, рендер в среднем {chart_stats['avg_render_ms']:.0f} мс "
+        f"(макс. {chart_stats['max_render_ms']:.0f} мс), с учетом пула {chart_stats['avg_total_ms']:.0f} мс"
+    )
+    lines.append(
+        f"📊 Кеш /stats: попаданий {stats_engine.stats['hits']}, пересчетов {stats_engine.stats['misses']}"
+    )
+    alert_stats = alert_scheduler.stats
+    lines.append(
+        f"🔔 Предупреждения: в очереди {len(alert_scheduler)}, обработано событий {alert_stats['processed']}, "
+        f"отправлено {alert_stats['sent']}, перепланировано клиентов {alert_stats['rescheduled']}"
+    )
+    lines.append(f"📎 Сохраненных file_id медиа: {await asyncio.to_thread(file_id_store.count)}")
+    lines.append(f"⏱ Запросы к БД: {async_db.stats['calls']}, таймаутов {async_db.stats['timeouts']}")
+    
+    await update.message.reply_text("\n".join(lines))
+
+def format_gb(value: int) -> str:
+    """Байты в GB для сообщений"""
+    return f"{round(value / (1024**3), 3)}GB"
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /stats - сводная статистика трафика"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Извините, у вас нет прав на выполнение этой команды.")
+        return
+    
+    stats = await async_db.run(stats_engine.get_stats, default=None)
+    if not stats:
+        await update.message.reply_text("❌ Не удалось получить статистику трафика.")
+        return
+    
+    snapshot = await async_db.run(db_manager.get_snapshot, default=None)
+    inbounds = snapshot.inbounds if snapshot else {}
+    clients_by_email = snapshot.clients_by_email if snapshot else {}
+    
+    lines = ["📊 Статистика трафика:\n"]
+    lines.append(
+        f"👥 Клиентов: {stats['clients']}, с трафиком: {stats['active']}\n"
+        f"🔼 Исходящий: ↑{format_gb(stats['up'])}\n"
+        f"🔽 Входящий: ↓{format_gb(stats['down'])}\n"
+        f"📊 Всего: ↑↓{format_gb(stats['total'])}"
+    )
+    percentiles = stats['percentiles']
+    lines.append(
+        f"📐 На клиента: p50 {format_gb(percentiles['p50'])}, p90 {format_gb(percentiles['p90'])}, "
+        f"p99 {format_gb(percentiles['p99'])}"
+    )
+    
+    if stats['top']:
+        lines.append(f"\n🏆 Топ-{len(stats['top'])} по трафику:")
+        for position, (email, used) in enumerate(stats['top'], 1):
+            lines.append(f"{position}. {email}: {format_gb(used)}")
+    
+    if stats['per_inbound']:
+        lines.append("\n🔌 По inbound:")
+        for inbound_id, used in sorted(stats['per_inbound'].items(), key=lambda item: item[1], reverse=True):
+            inbound = inbounds.get(inbound_id)
+            remark = f" {inbound.data['remark']}" if inbound and inbound.data.get('remark') else ""
+            lines.append(f"#{inbound_id}{remark}: {format_gb(used)}")
+    
+    near_quota = stats['near_quota']
+    if near_quota:
+        lines.append(f"\n⚠️ Близко к лимиту ({len(near_quota)}):")
+        for email, used, total in near_quota[:STATS_TOP_N]:
+            client = clients_by_email.get(email)
+            tg = f" (tgId {client.tg_id})" if client and client.tg_id else ""
+            lines.append(f"{email}{tg}: {format_gb(used)} из {format_gb(total)} ({used / total:.0%})")
+        if len(near_quota) > STATS_TOP_N:
+            lines.append(f"... и еще {len(near_quota) - STATS_TOP_N}")
+    
+    await update.message.reply_text("\n".join(lines))
+
 async def mail_cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отмена рассылки на любом этапе"""
     query = update.callback_query
@@ -629,7 +1041,7 @@ async def report_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     logger.info(f"[REPORT] ===== ENTRY POINT: Команда /report от пользователя {user_id} =====")
     
     # Проверяем авторизацию
-    if not db_manager.is_user_authorized(user_id):
+    if not await async_db.is_user_authorized(user_id):
         logger.warning(f"[REPORT] Пользователь {user_id} не авторизован")
         await update.message.reply_text("❌ Вы не авторизованы. Обратитесь к администратору.")
         return END
@@ -843,13 +1255,13 @@ async def report_cancel_handler(update: Update, context: ContextTypes.DEFAULT_TY
 
 # ==================== МОНИТОРИНГ ====================
 
-def format_new_client_message(client: Dict) -> str:
+async def format_new_client_message(client: Client) -> str:
     """Форматировать информацию о новом клиенте для сообщения"""
-    client_id = client.get('id', 'Неизвестно')
-    email = client.get('email', 'Неизвестно')
+    client_id = client.id or 'Неизвестно'
+    email = client.email or 'Неизвестно'
     
     # Получаем информацию о трафике
-    total = client.get('total', 0)
+    total = client.total
     if total == 0:
         traffic_info = "♾️ Unlimited(Reset)"
     else:
@@ -857,7 +1269,7 @@ def format_new_client_message(client: Dict) -> str:
         traffic_info = f"{round(traffic_gb, 3)}GB"
     
     # Получаем дату исчерпания
-    expiry_time = client.get('expiryTime', 0)
+    expiry_time = client.expiry_time
     if expiry_time == 0:
         expiry_info = "♾️ Безлимит"
     else:
@@ -865,12 +1277,12 @@ def format_new_client_message(client: Dict) -> str:
         expiry_info = expiry_date.strftime("%Y-%m-%d %H:%M:%S")
     
     # Получаем комментарий
-    comment = client.get('comment', '')
+    comment = client.comment
     if not comment:
         comment = 'Нет комментария'
     
-    # Получаем remark инбаунда
-    inbound_remark = db_manager.get_inbound_remark()
+    # Получаем remark инбаунда, к которому относится клиент
+    inbound_remark = await async_db.get_inbound_remark(client.email)
     
     message = f"🔄 Инбаунды: {inbound_remark}\n\n"
     message += f"🔑 ID: {client_id}\n"
@@ -883,52 +1295,85 @@ def format_new_client_message(client: Dict) -> str:
 
 async def monitor_database_changes(application: Application) -> None:
     """Мониторинг изменений в БД и отправка уведомлений"""
-    global monitoring_active, last_configs, last_clients
+    global monitoring_active, last_fingerprints
     
     monitoring_active = True
     logger.info("Запуск мониторинга изменений БД...")
     
-    # Инициализируем начальное состояние
-    last_configs = db_manager.get_all_user_configs()
-    last_clients = db_manager.get_all_clients()
+    watcher = DatabaseWatcher(db_manager.db_path, db_manager.get_db_signature)
+    watcher.start()
+    
+    # Инициализируем начальное состояние (повторяем, пока БД не ответит)
+    last_version = 0
+    while monitoring_active:
+        try:
+            last_version = await async_db.get_snapshot_version()
+            last_fingerprints = await async_db.get_config_fingerprints()
+            break
+        except Exception as e:
+            logger.error(f"Ошибка при инициализации мониторинга БД: {e}")
+            await asyncio.sleep(60)
+    
+    # После ошибки проверка повторяется без ожидания нового изменения файла
+    needs_check = False
     
     while monitoring_active:
         try:
-            # Проверяем изменения конфигов
-            changed_configs = db_manager.check_config_changes(last_configs)
+            # Ждем изменения файла БД (с таймаутом, чтобы проверять флаг остановки)
+            if not needs_check and not await watcher.wait_for_change(timeout=5):
+                continue
+            needs_check = True
             
-            # Отправляем уведомления о изменениях конфигов
-            for tg_id, updated_configs in changed_configs.items():
-                for config_data in updated_configs:
-                    email = config_data['email']
-                    config = config_data['config']
-                    
-                    message = f"🚨 Конфиг для {email} был обновлён\n\n"
-                    message += f"```\n{config}\n```"
-                    
-                    # Добавляем кнопку "Меню"
-                    keyboard = [[InlineKeyboardButton("📋 Меню", callback_data="menu_from_config")]]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    
-                    try:
-                        await application.bot.send_message(
-                            chat_id=tg_id,
-                            text=message,
-                            parse_mode='Markdown',
-                            reply_markup=reply_markup
-                        )
-                        logger.info(f"Отправлено уведомление об обновлении конфига для {email} (TG ID: {tg_id})")
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки уведомления для {tg_id}: {e}")
+            # Меню с изменившимся трафиком больше не актуально
+            await invalidate_menu_cache()
             
-            # Проверяем новых клиентов
-            new_clients = db_manager.check_new_clients(last_clients)
+            # Файл мог измениться без изменения inbound (например, обновился только трафик)
+            version = await async_db.get_snapshot_version()
+            if version == last_version:
+                needs_check = False
+                continue
+            
+            # Изменились inbound - меню могло поменяться у любого пользователя
+            menu_cache.invalidate()
+            # Клиенты могли получить новую квоту или срок подписки
+            alerts_wakeup.set()
+            
+            # Сравниваем отпечатки конфигов с предыдущим состоянием
+            changes, new_fingerprints = await async_db.diff_config_fingerprints(last_fingerprints)
+            
+            # Конфиги рендерим только для изменившихся клиентов с Telegram ID; смена inbound может
+            # затронуть всех его клиентов, поэтому мимо LRU, чтобы не вытеснить конфиги активных пользователей
+            changed_clients = [client for client in changes.added + changes.modified if client.tg_id]
+            changed_configs = await async_db.generate_vless_configs(changed_clients, use_cache=False)
+            
+            # Отправляем уведомления о изменениях конфигов
+            for client, config in zip(changed_clients, changed_configs):
+                tg_id = client.tg_id
+                email = client.email
+                
+                message = f"🚨 Конфиг для {email} был обновлён\n\n"
+                message += f"```\n{config}\n```"
+                
+                # Добавляем кнопку "Меню"
+                keyboard = [[InlineKeyboardButton("📋 Меню", callback_data="menu_from_config")]]
+                reply_markup = InlineKeyboardMarkup(keyboard)
+                
+                try:
+                    await application.bot.send_message(
+                        chat_id=tg_id,
+                        text=message,
+                        parse_mode='Markdown',
+                        reply_markup=reply_markup
+                    )
+                    logger.info(f"Отправлено уведомление об обновлении конфига для {email} (TG ID: {tg_id})")
+                except Exception as e:
+                    logger.error(f"Ошибка отправки уведомления для {tg_id}: {e}")
             
             # Отправляем уведомления о новых клиентах администраторам
-            for new_client in new_clients:
-                client_info = format_new_client_message(new_client)
-                client_email = new_client.get('email', '')
-                client_id = new_client.get('id', '')
+            for new_client in changes.added:
+                client_info = await format_new_client_message(new_client)
+                client_email = new_client.email
+                client_id = new_client.id
                 
                 # Добавляем кнопку "Конфиг"
                 keyboard = [[InlineKeyboardButton("🔑 Конфиг", callback_data=f"admin_config_{client_id}")]]
@@ -946,21 +1391,20 @@ async def monitor_database_changes(application: Application) -> None:
                     except Exception as e:
                         logger.error(f"Ошибка отправки уведомления о новом клиенте администратору {admin_id}: {e}")
             
-            # Обновляем состояние
-            if changed_configs:
-                last_configs = db_manager.get_all_user_configs()
-                logger.info(f"Обнаружены изменения в конфигах: {len(changed_configs)} пользователей")
-            
-            if new_clients:
-                last_clients = db_manager.get_all_clients()
-                logger.info(f"Обнаружены новые клиенты: {len(new_clients)}")
+            if changes:
+                logger.info(f"Обнаружены изменения клиентов: новых {len(changes.added)}, "
+                            f"изменено {len(changes.modified)}, удалено {len(changes.removed)}")
             
-            # Ждем перед следующей проверкой
-            await asyncio.sleep(30)  # Проверяем каждые 30 секунд
+            # Новые отпечатки собраны по тому же снимку, что и сравнение
+            last_fingerprints = new_fingerprints
+            last_version = version
+            needs_check = False
             
         except Exception as e:
             logger.error(f"Ошибка в мониторинге БД: {e}")
-            await asyncio.sleep(60)  # При ошибке ждем дольше
+            await asyncio.sleep(5)  # При ошибке делаем паузу перед повторной попыткой
+    
+    watcher.close()
 
 def main() -> None:
     """Основная функция для запуска бота"""
@@ -970,6 +1414,10 @@ def main() -> None:
     # Добавляем обработчики команд (ВАЖНО: перед ConversationHandler)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("menu", menu))
+    application.add_handler(CommandHandler("jobs", jobs_command))
+    application.add_handler(CommandHandler("canceljob", cancel_job_command))
+    application.add_handler(CommandHandler("metrics", metrics_command))
+    application.add_handler(CommandHandler("stats", stats_command))
     
     # ConversationHandler для рассылки
     # Fallbacks обрабатывают кнопки во ВСЕХ состояниях ConversationHandler
@@ -1026,6 +1474,11 @@ def main() -> None:
         
         # Запускаем мониторинг как фоновую задачу
         asyncio.create_task(monitor_database_changes(application))
+        asyncio.create_task(record_traffic_history())
+        asyncio.create_task(run_alerts(application.bot))
+        
+        # Продолжаем рассылки, прерванные перезапуском
+        await resume_broadcasts(application)
     
     # Добавляем обработчик инициализации
     application.post_init = post_init
@@ -1035,7 +1488,17 @@ def main() -> None:
         """Остановка мониторинга при завершении"""
         global monitoring_active
         monitoring_active = False
+        alerts_wakeup.set()
         logger.info("Мониторинг изменений БД остановлен")
+        
+        async_db.shutdown()
+        qr_renderer.shutdown()
+        chart_renderer.shutdown()
+        db_manager.pool.close_all()
+        broadcast_store.close()
+        file_id_store.close()
+        traffic_history.close()
+        alert_store.close()
     
     application.post_stop = post_stop
     
@@ -0,0 +1,167 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Глобальный лимит Telegram ~30 сообщений/с, держим запас
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '10'))
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '3'))
+
+ProgressCallback = Callable[['BroadcastResult'], Awaitable[None]]
+SendingCallback = Callable[[int], Awaitable[None]]
+ResultCallback = Callable[[int, bool, Optional[str]], Awaitable[None]]
+
+class TokenBucket:
+    """Ограничитель частоты запросов (token bucket) с возможностью общей паузы"""
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        # Небольшой запас на всплеск, чтобы не превысить лимит в окне 1 секунда
+        self.capacity = capacity or max(1.0, rate / 5)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Приостановить выдачу токенов (например, после RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        """Дождаться свободного токена"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class BroadcastResult:
+    """Прогресс и итог рассылки"""
+    def __init__(self, total: int):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self) -> float:
+        """Фактическая скорость отправки, сообщений/с"""
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Получить паузу из RetryAfter (в новых версиях PTB это timedelta)"""
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, 'total_seconds') else float(value)
+
+class BroadcastEngine:
+    """Рассылка сообщений с ограничением частоты, параллельностью и повторами"""
+    def __init__(self, bot, rate: float = BROADCAST_RATE, concurrency: int = BROADCAST_CONCURRENCY,
+                 max_retries: int = BROADCAST_MAX_RETRIES, progress_interval: float = BROADCAST_PROGRESS_INTERVAL):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+
+    async def send_one(self, chat_id: int, text: str, result: BroadcastResult) -> Tuple[bool, Optional[str]]:
+        """Отправить одно сообщение с учетом RetryAfter и повторов при сетевых ошибках
+
+        Возвращает признак успеха и текст ошибки
+        """
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True, None
+            except RetryAfter as e:
+                # Флуд-контроль касается всего бота - тормозим все воркеры
+                delay = retry_after_seconds(e)
+                logger.warning(f"[MAIL] RetryAfter {delay}с при отправке пользователю {chat_id}")
+                self.bucket.pause(delay)
+                result.retries += 1
+            except (Forbidden, BadRequest) as e:
+                # Бот заблокирован или чат не существует - повтор не поможет
+                logger.error(f"[MAIL] Ошибка отправки сообщения пользователю {chat_id}: {e}")
+                return False, str(e)
+            except TelegramError as e:
+                # Таймауты и сетевые сбои - повторяем с экспоненциальной паузой
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"[MAIL] Ошибка отправки сообщения пользователю {chat_id} после {self.max_retries} повторов: {e}")
+                    return False, str(e)
+                result.retries += 1
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+    async def send(self, chat_ids: Iterable[int], text: str, progress_callback: Optional[ProgressCallback] = None,
+                   on_sending: Optional[SendingCallback] = None, on_result: Optional[ResultCallback] = None,
+                   should_stop: Optional[Callable[[], bool]] = None) -> BroadcastResult:
+        """Разослать сообщение всем chat_ids, периодически сообщая прогресс
+
+        on_sending/on_result (корутины) позволяют сохранять статус каждого получателя,
+        should_stop - остановить рассылку (оставшиеся получатели не обрабатываются)
+        """
+        chat_ids = list(chat_ids)
+        result = BroadcastResult(len(chat_ids))
+        queue: asyncio.Queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            queue.put_nowait(chat_id)
+
+        async def worker():
+            while not (should_stop and should_stop()):
+                try:
+                    chat_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if on_sending:
+                    await on_sending(chat_id)
+                success, error = await self.send_one(chat_id, text, result)
+                if success:
+                    result.sent += 1
+                else:
+                    result.failed += 1
+                if on_result:
+                    await on_result(chat_id, success, error)
+
+        async def report_progress():
+            while True:
+                await asyncio.sleep(self.progress_interval)
+                try:
+                    await progress_callback(result)
+                except Exception as e:
+                    logger.error(f"[MAIL] Ошибка обновления прогресса рассылки: {e}")
+
+        progress_task = asyncio.create_task(report_progress()) if progress_callback else None
+        try:
+            workers: List[asyncio.Task] = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(chat_ids)))]
+            await asyncio.gather(*workers)
+        finally:
+            if progress_task:
+                progress_task.cancel()
+            result.finished = time.monotonic()
+
+        return result
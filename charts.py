@@ -0,0 +1,109 @@
+import io
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from qr import create_render_pool
+
+# Процессы для рендера графиков
+CHART_RENDER_WORKERS = int(os.getenv('CHART_RENDER_WORKERS', '1'))
+# Сколько последних дней показывать на графике
+CHART_DAYS = int(os.getenv('CHART_DAYS', '14'))
+
+WIDTH, HEIGHT = 900, 450
+MARGIN_LEFT, MARGIN_RIGHT, MARGIN_TOP, MARGIN_BOTTOM = 70, 20, 50, 50
+UP_COLOR = (66, 133, 244)
+DOWN_COLOR = (52, 168, 83)
+
+# Строка графика: подпись дня, up и down в байтах
+DayBucket = Tuple[str, int, int]
+
+def render_usage_chart(buckets: List[DayBucket], title: str) -> Tuple[bytes, float]:
+    """Нарисовать столбчатый график трафика по дням в PNG (выполняется в отдельном процессе)
+
+    Возвращает PNG и время рендера в секундах. Подписи латиницей: шрифт Pillow по умолчанию без кириллицы
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    started = time.perf_counter()
+    image = Image.new('RGB', (WIDTH, HEIGHT), 'white')
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=13)
+    title_font = ImageFont.load_default(size=18)
+
+    plot_width = WIDTH - MARGIN_LEFT - MARGIN_RIGHT
+    plot_height = HEIGHT - MARGIN_TOP - MARGIN_BOTTOM
+    bottom = HEIGHT - MARGIN_BOTTOM
+    max_gb = max([max(up, down) for _, up, down in buckets] + [1]) / 1024 ** 3
+
+    draw.text((MARGIN_LEFT, 12), title, fill='black', font=title_font)
+    draw.rectangle((WIDTH - 190, 16, WIDTH - 178, 28), fill=UP_COLOR)
+    draw.text((WIDTH - 172, 14), "Upload", fill='black', font=font)
+    draw.rectangle((WIDTH - 100, 16, WIDTH - 88, 28), fill=DOWN_COLOR)
+    draw.text((WIDTH - 82, 14), "Download", fill='black', font=font)
+
+    # Горизонтальная сетка с подписями в GB
+    for step in range(5):
+        value = max_gb * step / 4
+        y = bottom - plot_height * step / 4
+        draw.line((MARGIN_LEFT, y, WIDTH - MARGIN_RIGHT, y), fill=(225, 225, 225))
+        draw.text((8, y - 8), f"{value:.2f} GB", fill='gray', font=font)
+
+    slot = plot_width / max(len(buckets), 1)
+    bar = max(slot * 0.35, 1)
+    for index, (label, up, down) in enumerate(buckets):
+        x = MARGIN_LEFT + slot * index + slot * 0.15
+        for offset, value, color in ((0, up, UP_COLOR), (bar, down, DOWN_COLOR)):
+            height = plot_height * (value / 1024 ** 3) / max_gb
+            if height > 0:
+                draw.rectangle((x + offset, bottom - height, x + offset + bar - 1, bottom), fill=color)
+        draw.text((x, bottom + 8), label, fill='black', font=font)
+
+    draw.line((MARGIN_LEFT, bottom, WIDTH - MARGIN_RIGHT, bottom), fill='black')
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue(), time.perf_counter() - started
+
+class ChartRenderer:
+    """Рендер графиков трафика в пуле процессов с метриками времени генерации"""
+    def __init__(self, workers: int = CHART_RENDER_WORKERS):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # render - время рендера в процессе, total - с учетом передачи в пул и обратно
+        self.stats = {'renders': 0, 'render_time': 0.0, 'max_render_time': 0.0, 'total_time': 0.0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Пул процессов создается при первом запросе графика"""
+        if self._executor is None:
+            self._executor = create_render_pool(self.workers)
+        return self._executor
+
+    async def render(self, buckets: List[DayBucket], title: str) -> bytes:
+        """Отрисовать график вне event loop"""
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        png, render_time = await loop.run_in_executor(self._get_executor(), render_usage_chart, buckets, title)
+
+        self.stats['renders'] += 1
+        self.stats['render_time'] += render_time
+        self.stats['max_render_time'] = max(self.stats['max_render_time'], render_time)
+        self.stats['total_time'] += time.perf_counter() - started
+        return png
+
+    def get_stats(self) -> Dict:
+        """Получить метрики генерации графиков (время в мс)"""
+        renders = self.stats['renders']
+        return {
+            'renders': renders,
+            'avg_render_ms': self.stats['render_time'] / renders * 1000 if renders else 0.0,
+            'max_render_ms': self.stats['max_render_time'] * 1000,
+            'avg_total_ms': self.stats['total_time'] / renders * 1000 if renders else 0.0
+        }
+
+    def shutdown(self):
+        """Остановить пул процессов"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -1,56 +1,528 @@
 import sqlite3
 import json
 import os
+import re
+import sys
 import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from urllib.parse import quote, urlencode
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import Any, Hashable, Iterator, List, Dict, Optional, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
 
-class DatabaseManager:
+# Максимум email в одном запросе статистики трафика (лимит параметров SQLite - 999)
+TRAFFIC_QUERY_BATCH = 500
+
+# Настройки пула read-only соединений
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '5'))  # Секунды ожидания блокировки писателя
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '8192'))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(64 * 1024 * 1024)))
+
+# Способ разбора settings inbound: json - целиком, stream - потоково с компактными клиентами
+SETTINGS_LOADER = os.getenv('SETTINGS_LOADER', 'json')
+
+# Режим запросов клиентов пользователя (меню, авторизация): python - через кеш снимков, json1 - фильтрация внутри SQLite
+DB_QUERY_MODE = os.getenv('DB_QUERY_MODE', 'python')
+
+# Строк за одну выборку при потоковом хешировании таблиц
+DIGEST_FETCH_SIZE = 1000
+
+# Данные для хешей состояния БД: конфигурация inbound (большие поля как BLOB) и счетчики трафика
+CONFIG_DIGEST_QUERY = (
+    "SELECT id, CAST(settings AS BLOB), listen, port, remark, CAST(stream_settings AS BLOB), protocol "
+    "FROM inbounds WHERE enable = 1 ORDER BY id"
+)
+TRAFFIC_DIGEST_QUERY = "SELECT email, up, down FROM client_traffics ORDER BY rowid"
+
+# Максимум готовых конфигов в LRU кеше
+CONFIG_CACHE_SIZE = int(os.getenv('CONFIG_CACHE_SIZE', '1024'))
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def _skip_json_whitespace(text: str, pos: int) -> int:
+    return _JSON_WHITESPACE.match(text, pos).end()
+
+def iter_settings_items(settings_text: str) -> Iterator[Tuple[str, object]]:
+    """Потоково перебрать ключи settings: для clients значение - итератор по клиентам
+    
+    Клиенты разбираются по одному, поэтому весь массив никогда не держится в памяти целиком.
+    Итератор clients нужно дочитать до запроса следующего ключа.
+    """
+    pos = _skip_json_whitespace(settings_text, 0)
+    if settings_text[pos:pos + 1] != '{':
+        raise ValueError("settings должен быть JSON-объектом")
+    pos = _skip_json_whitespace(settings_text, pos + 1)
+    
+    while settings_text[pos:pos + 1] != '}':
+        key, pos = _JSON_DECODER.raw_decode(settings_text, pos)
+        pos = _skip_json_whitespace(settings_text, pos)
+        if settings_text[pos:pos + 1] != ':':
+            raise ValueError(f"Ожидался ':' в позиции {pos}")
+        pos = _skip_json_whitespace(settings_text, pos + 1)
+        
+        if key == 'clients' and settings_text[pos:pos + 1] == '[':
+            cursor = [pos]
+            
+            def iter_clients():
+                item_pos = _skip_json_whitespace(settings_text, cursor[0] + 1)
+                while settings_text[item_pos:item_pos + 1] != ']':
+                    client, item_pos = _JSON_DECODER.raw_decode(settings_text, item_pos)
+                    yield client
+                    item_pos = _skip_json_whitespace(settings_text, item_pos)
+                    if settings_text[item_pos:item_pos + 1] == ',':
+                        item_pos = _skip_json_whitespace(settings_text, item_pos + 1)
+                cursor[0] = item_pos + 1
+            
+            yield key, iter_clients()
+            pos = cursor[0]
+        else:
+            value, pos = _JSON_DECODER.raw_decode(settings_text, pos)
+            yield key, value
+        
+        pos = _skip_json_whitespace(settings_text, pos)
+        if settings_text[pos:pos + 1] == ',':
+            pos = _skip_json_whitespace(settings_text, pos + 1)
+
+def iter_json_clients(settings_text: str) -> Iterator[Dict]:
+    """Потоково перебрать клиентов из JSON settings"""
+    for key, value in iter_settings_items(settings_text):
+        if key == 'clients':
+            yield from value
+
+@dataclass(slots=True)
+class Client:
+    """Компактная запись клиента: только поля, которые использует бот"""
+    id: str
+    email: str
+    tg_id: int = 0
+    enable: bool = True
+    total: int = 0
+    expiry_time: int = 0
+    comment: str = ''
+    flow: str = ''
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Client':
+        """Создать запись из JSON-объекта клиента 3x-ui"""
+        try:
+            tg_id = int(data.get('tgId') or 0)
+        except (TypeError, ValueError):
+            tg_id = 0
+        
+        # id и email - ключи индексов и отпечатков, интернируем, чтобы не держать копии строк
+        return cls(
+            id=sys.intern(str(data.get('id', ''))),
+            email=sys.intern(str(data.get('email', ''))),
+            tg_id=tg_id,
+            enable=bool(data.get('enable', True)),
+            total=int(data.get('total') or 0),
+            expiry_time=int(data.get('expiryTime') or 0),
+            comment=data.get('comment') or '',
+            flow=sys.intern(data.get('flow') or '')
+        )
+
+def load_settings_compact(settings_text: str) -> Tuple[Dict, List[Client]]:
+    """Разобрать settings потоково: клиенты сразу превращаются в компактные записи"""
+    settings = {}
+    clients = []
+    for key, value in iter_settings_items(settings_text):
+        if key == 'clients':
+            clients = [Client.from_dict(client) for client in value]
+        else:
+            settings[key] = value
+    return settings, clients
+
+# Символы, которые остаются как есть во фрагменте VLESS ссылки (#remark-email)
+VLESS_FRAGMENT_SAFE = "@"
+
+class VlessTemplate:
+    """Скомпилированный шаблон VLESS ссылки inbound: для клиента остается подставить UUID, flow и email"""
+    __slots__ = ('prefix', 'fragment', '_middles')
+    
+    def __init__(self, prefix: str, fragment: str):
+        self.prefix = prefix      # "@host:port?type=...&spx=%2F" - общие параметры inbound
+        self.fragment = fragment  # "#remark-" уже в закодированном виде
+        self._middles: Dict[str, str] = {}  # Готовая середина ссылки для каждого значения flow
+    
+    def middle(self, flow: str) -> str:
+        """Часть ссылки между UUID и email для заданного flow"""
+        middle = self._middles.get(flow)
+        if middle is None:
+            flow_param = f"&flow={quote(flow, safe='')}" if flow else ""
+            middle = self._middles[flow] = self.prefix + flow_param + self.fragment
+        return middle
+    
+    def render(self, client: Client) -> str:
+        """Собрать ссылку клиента"""
+        return f"vless://{client.id}{self.middle(client.flow)}{quote(client.email, safe=VLESS_FRAGMENT_SAFE)}"
+
+class LRUCache:
+    """Потокобезопасный LRU кеш ограниченного размера со статистикой попаданий"""
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Получить значение (None, если его нет в кеше)"""
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.stats['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+    
+    def put(self, key: Hashable, value: Any):
+        """Сохранить значение, вытеснив самое давно использованное при переполнении"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.stats['evictions'] += 1
+    
+    def get_stats(self) -> Dict:
+        """Получить метрики кеша"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self._items)
+        stats['max_size'] = self.max_size
+        requests = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / requests if requests else 0.0
+        return stats
+
+class ReadOnlyConnectionPool:
+    """Пул долгоживущих read-only соединений с БД"""
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle: List[Tuple[sqlite3.Connection, Tuple]] = []  # (соединение, идентификатор файла)
+        self._lock = threading.Lock()
+        self.stats = {'opened': 0, 'reused': 0, 'closed': 0, 'rotated': 0}
+    
+    def _file_identity(self) -> Tuple:
+        """Идентификатор файла БД - меняется, если панель подменила файл"""
+        st = os.stat(self.db_path)
+        return (st.st_dev, st.st_ino)
+    
+    def _open(self) -> sqlite3.Connection:
+        """Открыть новое соединение только для чтения"""
+        # immutable=1 не используем: тогда SQLite не увидит изменений от 3x-ui
+        uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # Для доступа к колонкам по имени
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        with self._lock:
+            self.stats['opened'] += 1
+        return conn
+    
+    def _close(self, conn: sqlite3.Connection):
+        """Закрыть соединение"""
+        try:
+            conn.close()
+        except Exception as e:
+            print(f"Ошибка при закрытии соединения с БД: {e}")
+        with self._lock:
+            self.stats['closed'] += 1
+    
+    def acquire(self) -> Tuple[sqlite3.Connection, Tuple]:
+        """Взять соединение из пула (или открыть новое)"""
+        identity = self._file_identity()
+        stale = []
+        conn = None
+        with self._lock:
+            while self._idle:
+                idle_conn, idle_identity = self._idle.pop()
+                if idle_identity == identity:
+                    conn = idle_conn
+                    self.stats['reused'] += 1
+                    break
+                stale.append(idle_conn)
+                self.stats['rotated'] += 1
+        
+        # Соединения на старый файл после ротации БД больше не нужны
+        for stale_conn in stale:
+            self._close(stale_conn)
+        
+        if conn is None:
+            conn = self._open()
+        return conn, identity
+    
+    def release(self, conn: sqlite3.Connection, identity: Tuple):
+        """Вернуть соединение в пул"""
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((conn, identity))
+                return
+        self._close(conn)
+    
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: соединение возвращается в пул после использования"""
+        conn, identity = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # Любая ошибка в теле (не только DatabaseError): соединение могло прийти в негодность
+            # или остаться с незавершенным запросом - не возвращаем его в пул, но обязательно закрываем
+            self._close(conn)
+            raise
+        else:
+            self.release(conn, identity)
+    
+    def close_all(self):
+        """Закрыть все простаивающие соединения"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+    
+    def get_stats(self) -> Dict:
+        """Получить метрики пула соединений"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['idle'] = len(self._idle)
+        return stats
+
+class InboundSnapshot:
+    """Разобранный снимок одного inbound, переиспользуется, пока не изменится его строка в БД"""
+    def __init__(self, inbound_id: int, version: int, raw_hash: int, data: Dict, clients: List[Client]):
+        self.id = inbound_id
+        self.version = version  # Номер разбора JSON, на котором получен снимок
+        self.raw_hash = raw_hash  # Хеш исходной строки: сравнение без разбора и без копии текста settings
+        self.data = data        # settings без clients - клиенты хранятся только в self.clients
+        self.clients = clients
+        self.vless_template: Optional[VlessTemplate] = None  # Компилируется лениво при первой генерации конфига
+
+class PanelSnapshot:
+    """Снимок всех включенных inbound с общими индексами клиентов"""
+    def __init__(self, version: int, inbounds: Dict[int, InboundSnapshot]):
+        self.version = version  # Растет при изменении любого inbound
+        self.inbounds = inbounds
+        
+        # Индексы клиентов всех inbound для поиска за O(1)
+        self.clients: List[Client] = []
+        self.clients_by_tg_id: Dict[int, List[Client]] = {}
+        self.clients_by_email: Dict[str, Client] = {}
+        self.clients_by_id: Dict[str, Client] = {}
+        self.inbound_by_email: Dict[str, InboundSnapshot] = {}
+        for inbound in inbounds.values():
+            for client in inbound.clients:
+                self.clients.append(client)
+                if client.tg_id:
+                    self.clients_by_tg_id.setdefault(client.tg_id, []).append(client)
+                if client.email:
+                    self.clients_by_email[client.email] = client
+                    self.inbound_by_email[client.email] = inbound
+                if client.id:
+                    self.clients_by_id[client.id] = client
+    
+    def get_client_inbound(self, client: Client) -> Optional[InboundSnapshot]:
+        """Получить inbound, к которому относится клиент"""
+        inbound = self.inbound_by_email.get(client.email)
+        if inbound is None and self.inbounds:
+            inbound = next(iter(self.inbounds.values()))
+        return inbound
+
+class ConfigChanges:
+    """Результат сравнения отпечатков клиентов с предыдущим состоянием"""
     def __init__(self):
-        self.db_path = os.getenv('DB_PATH')
+        self.added: List[Client] = []     # Новые клиенты (по email)
+        self.modified: List[Client] = []  # Клиенты, у которых изменился конфиг
+        self.removed: List[str] = []    # Email удаленных клиентов
+    
+    def __bool__(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+class DatabaseManager:
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv('DB_PATH')
         if not self.db_path:
             raise ValueError("DB_PATH не найден в переменных окружения!")
+        
+        self.pool = ReadOnlyConnectionPool(self.db_path)
+        
+        # Кеш разобранных inbound
+        self._snapshot: Optional[PanelSnapshot] = None
+        self._snapshot_signature = None
+        self._snapshot_version = 0
+        self._parse_version = 0
+        self._snapshot_lock = threading.Lock()  # Снимок может запрашиваться из нескольких потоков
+        self.snapshot_stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'parsed_inbounds': 0}
+        
+        self.query_mode = DB_QUERY_MODE
+        self._json1_available: Optional[bool] = None
+        
+        # Готовые конфиги по (UUID клиента, версия снимка inbound) - новая версия inbound сама вытесняет старые
+        self.config_cache = LRUCache(CONFIG_CACHE_SIZE)
     
     def get_connection(self):
-        """Получить соединение с БД (read-only для избежания блокировок)"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # Для доступа к колонкам по имени
-        return conn
+        """Получить соединение с БД из пула (read-only для избежания блокировок)"""
+        return self.pool.connection()
+    
+    def get_pool_stats(self) -> Dict:
+        """Получить метрики пула соединений (открыто, переиспользовано, закрыто)"""
+        return self.pool.get_stats()
+    
+    def get_db_signature(self) -> Tuple:
+        """Получить сигнатуру файлов БД (mtime, размер, inode) включая -wal"""
+        signature = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size, st.st_ino))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+    
+    def get_snapshot(self) -> Optional[PanelSnapshot]:
+        """Получить снимок всех inbound, разбирая JSON только изменившихся inbound"""
+        with self._snapshot_lock:
+            return self._load_snapshot()
     
-    def get_inbound_data(self) -> Optional[Dict]:
-        """Получить данные первого inbound (settings, listen, port, remark, stream_settings)"""
+    def _load_snapshot(self) -> Optional[PanelSnapshot]:
+        """Загрузить снимок inbound (вызывается под блокировкой)"""
+        signature = self.get_db_signature()
+        if self._snapshot and signature == self._snapshot_signature:
+            self.snapshot_stats['hits'] += 1
+            return self._snapshot
+        
         try:
             with self.get_connection() as conn:
-                cursor = conn.execute("SELECT settings, listen, port, remark, stream_settings FROM inbounds LIMIT 1")
-                row = cursor.fetchone()
-                if row:
-                    inbound_data = {
-                        'settings': json.loads(row['settings']) if row['settings'] else {},
-                        'listen': row['listen'],
-                        'port': row['port'],
-                        'remark': row['remark'],
-                        'stream_settings': json.loads(row['stream_settings']) if row['stream_settings'] else {}
-                    }
-                    return inbound_data
+                cursor = conn.execute(
+                    "SELECT id, settings, listen, port, remark, stream_settings, protocol FROM inbounds WHERE enable = 1 ORDER BY id"
+                )
+                rows = cursor.fetchall()
         except Exception as e:
             print(f"Ошибка при чтении inbound данных: {e}")
-        return None
+            return None
+        
+        old_inbounds = self._snapshot.inbounds if self._snapshot else {}
+        inbounds = {}
+        changed = len(rows) != len(old_inbounds)
+        
+        for row in rows:
+            raw_hash = hash(tuple(row))
+            old_inbound = old_inbounds.get(row['id'])
+            
+            # Строка inbound не изменилась - переиспользуем разобранный JSON
+            if old_inbound and old_inbound.raw_hash == raw_hash:
+                inbounds[row['id']] = old_inbound
+                continue
+            
+            try:
+                settings, clients = self.load_settings(row['settings'])
+                inbound_data = {
+                    'id': row['id'],
+                    'settings': settings,
+                    'listen': row['listen'],
+                    'port': row['port'],
+                    'remark': row['remark'],
+                    'protocol': row['protocol'],
+                    'stream_settings': json.loads(row['stream_settings']) if row['stream_settings'] else {}
+                }
+            except Exception as e:
+                print(f"Ошибка при разборе inbound {row['id']}: {e}")
+                # Оставляем последний успешно разобранный вариант, чтобы клиенты не "пропали"
+                if old_inbound:
+                    inbounds[row['id']] = old_inbound
+                continue
+            
+            self._parse_version += 1
+            self.snapshot_stats['parsed_inbounds'] += 1
+            inbounds[row['id']] = InboundSnapshot(row['id'], self._parse_version, raw_hash, inbound_data, clients)
+            changed = True
+        
+        self._snapshot_signature = signature
+        
+        # Файл изменился, но сами inbound нет (например, обновился трафик)
+        if self._snapshot and not changed:
+            self.snapshot_stats['revalidations'] += 1
+            return self._snapshot
+        
+        self.snapshot_stats['misses'] += 1
+        self._snapshot_version += 1
+        self._snapshot = PanelSnapshot(self._snapshot_version, inbounds)
+        return self._snapshot
+    
+    def load_settings(self, settings_text: Optional[str]) -> Tuple[Dict, List[Client]]:
+        """Разобрать settings inbound выбранным способом (SETTINGS_LOADER): настройки без clients и клиенты"""
+        if not settings_text:
+            return {}, []
+        if SETTINGS_LOADER == 'stream':
+            return load_settings_compact(settings_text)
+        settings = json.loads(settings_text)
+        return settings, [Client.from_dict(client) for client in settings.pop('clients', [])]
+    
+    def get_inbound_data(self, inbound_id: Optional[int] = None) -> Optional[Dict]:
+        """Получить данные inbound (settings, listen, port, remark, stream_settings), по умолчанию первого"""
+        snapshot = self.get_snapshot()
+        if not snapshot or not snapshot.inbounds:
+            return None
+        
+        if inbound_id is None:
+            return next(iter(snapshot.inbounds.values())).data
+        inbound = snapshot.inbounds.get(inbound_id)
+        return inbound.data if inbound else None
+    
+    def get_snapshot_version(self) -> int:
+        """Получить версию снимка inbound (растет только при изменении самих inbound)"""
+        snapshot = self.get_snapshot()
+        return snapshot.version if snapshot else 0
+    
+    def get_config_cache_stats(self) -> Dict:
+        """Получить статистику LRU кеша готовых конфигов"""
+        return self.config_cache.get_stats()
+    
+    def get_cache_stats(self) -> Dict:
+        """Получить статистику кеша снимков inbound"""
+        stats = dict(self.snapshot_stats)
+        stats['version'] = self._snapshot_version
+        stats['inbounds'] = len(self._snapshot.inbounds) if self._snapshot else 0
+        return stats
     
-    def get_user_clients(self, telegram_id: int) -> List[Dict]:
+    def get_user_clients(self, telegram_id: int) -> List[Client]:
         """Получить всех клиентов для данного Telegram ID"""
-        inbound_data = self.get_inbound_data()
-        if not inbound_data or 'clients' not in inbound_data.get('settings', {}):
+        if self.query_mode == 'json1' and self.has_json1():
+            return self.get_user_clients_json1(telegram_id)
+        
+        snapshot = self.get_snapshot()
+        if not snapshot:
             return []
         
-        user_clients = []
-        for client in inbound_data['settings']['clients']:
-            if client.get('tgId') == telegram_id:
-                user_clients.append(client)
+        return list(snapshot.clients_by_tg_id.get(telegram_id, []))
+    
+    def get_client_by_id(self, client_id: str) -> Optional[Client]:
+        """Получить клиента по его UUID"""
+        snapshot = self.get_snapshot()
+        if not snapshot:
+            return None
+        
+        return snapshot.clients_by_id.get(client_id)
+    
+    def get_client_by_email(self, email: str) -> Optional[Client]:
+        """Получить клиента по email"""
+        snapshot = self.get_snapshot()
+        if not snapshot:
+            return None
         
-        return user_clients
+        return snapshot.clients_by_email.get(email)
     
     def get_traffic_stats(self, email: str) -> Optional[Tuple[int, int]]:
         """Получить статистику трафика для email (up, down в байтах)"""
@@ -67,137 +539,332 @@ class DatabaseManager:
             print(f"Ошибка при чтении статистики трафика: {e}")
         return None
     
+    def get_traffic_stats_many(self, emails: List[str], strict: bool = False) -> Dict[str, Tuple[int, int]]:
+        """Получить статистику трафика для нескольких email одним запросом (up, down в байтах)
+        
+        strict=True - ошибки пробрасываются, чтобы вызывающий мог отличить сбой от отсутствия строк
+        """
+        stats = {}
+        if not emails:
+            return stats
+        
+        try:
+            with self.get_connection() as conn:
+                # SQLite ограничивает число параметров в запросе, поэтому режем на пачки
+                for start in range(0, len(emails), TRAFFIC_QUERY_BATCH):
+                    batch = emails[start:start + TRAFFIC_QUERY_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    cursor = conn.execute(
+                        f"SELECT email, up, down FROM client_traffics WHERE email IN ({placeholders})",
+                        batch
+                    )
+                    for row in cursor:
+                        stats[row['email']] = (row['up'], row['down'])
+        except Exception as e:
+            if strict:
+                raise
+            print(f"Ошибка при чтении статистики трафика: {e}")
+        return stats
+    
+    def get_all_traffic_stats(self) -> Dict[str, Tuple[int, int]]:
+        """Получить счетчики трафика всех клиентов (up, down в байтах)"""
+        stats = {}
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.execute("SELECT email, up, down FROM client_traffics")
+                while True:
+                    rows = cursor.fetchmany(DIGEST_FETCH_SIZE)
+                    if not rows:
+                        break
+                    for row in rows:
+                        stats[row['email']] = (row['up'] or 0, row['down'] or 0)
+        except Exception as e:
+            print(f"Ошибка при чтении статистики трафика: {e}")
+        return stats
+    
     def is_user_authorized(self, telegram_id: int) -> bool:
         """Проверить авторизован ли пользователь"""
-        return len(self.get_user_clients(telegram_id)) > 0
+        if self.query_mode == 'json1' and self.has_json1():
+            return bool(self.get_user_clients_json1(telegram_id, limit=1))
+        
+        snapshot = self.get_snapshot()
+        return bool(snapshot) and telegram_id in snapshot.clients_by_tg_id
     
     def bytes_to_gb(self, bytes_value: int) -> float:
         """Конвертировать байты в гигабайты"""
         return round(bytes_value / (1024 ** 3), 2)
     
-    def generate_vless_config(self, client: Dict) -> str:
-        """Сгенерировать VLESS конфиг для клиента"""
-        try:
-            inbound_data = self.get_inbound_data()
-            if not inbound_data:
-                return "Ошибка получения данных сервера"
-            
-            # Извлекаем данные из inbound_data
-            listen = inbound_data.get('listen', '0.0.0.0')
-            port = str(inbound_data.get('port', ''))
-            remark = inbound_data.get('remark', '')
-            
-            stream_settings = inbound_data.get('stream_settings', {})
-            network = stream_settings.get('network', 'tcp')
-            security = stream_settings.get('security', 'none')
-            
-            reality_settings = stream_settings.get('realitySettings', {})
-            server_name = reality_settings.get('serverNames', [''])[0]
-            short_id = reality_settings.get('shortIds', [''])[0]
+    def build_vless_template(self, inbound_data: Dict) -> VlessTemplate:
+        """Скомпилировать общую для всех клиентов часть VLESS конфига"""
+        # Извлекаем данные из inbound_data
+        listen = inbound_data.get('listen', '0.0.0.0')
+        if listen and ':' in listen and not listen.startswith('['):
+            listen = f"[{listen}]"  # IPv6 адрес в URL пишется в скобках
+        port = str(inbound_data.get('port', ''))
+        remark = inbound_data.get('remark') or ''
+        
+        stream_settings = inbound_data.get('stream_settings', {})
+        network = stream_settings.get('network', 'tcp')
+        security = stream_settings.get('security', 'none')
+        
+        reality_settings = stream_settings.get('realitySettings', {})
+        server_name = reality_settings.get('serverNames', [''])[0]
+        short_id = reality_settings.get('shortIds', [''])[0]
 
-            realitySettingsSettings = reality_settings.get('settings', {})
-            public_key = realitySettingsSettings.get('publicKey', '')
-            fingerprint = realitySettingsSettings.get('fingerprint', '')
-            
-            # Данные клиента
-            client_id = client.get('id', '')
-            email = client.get('email', '')
-            flow = 'xtls-rprx-vision'
-            
-            # Формируем конфиг
-            config = f"vless://{client_id}@{listen}:{port}?type={network}&security={security}&pbk={public_key}&fp={fingerprint}&sni={server_name}&sid={short_id}&spx=%2F&flow={flow}#{remark}-{email}"
+        realitySettingsSettings = reality_settings.get('settings', {})
+        public_key = realitySettingsSettings.get('publicKey', '')
+        fingerprint = realitySettingsSettings.get('fingerprint', '')
+        
+        query = urlencode({
+            'type': network,
+            'security': security,
+            'pbk': public_key,
+            'fp': fingerprint,
+            'sni': server_name,
+            'sid': short_id,
+            'spx': '/'
+        }, quote_via=quote, safe='')
+        
+        # flow у каждого клиента свой, поэтому добавляется при рендере
+        return VlessTemplate(f"@{listen}:{port}?{query}", f"#{quote(remark, safe=VLESS_FRAGMENT_SAFE)}-")
+    
+    def get_vless_template(self, snapshot: InboundSnapshot) -> VlessTemplate:
+        """Получить шаблон VLESS конфига, скомпилированный один раз на снимок inbound"""
+        if snapshot.vless_template is None:
+            snapshot.vless_template = self.build_vless_template(snapshot.data)
+        return snapshot.vless_template
+    
+    def generate_vless_configs(self, clients: List[Client], use_cache: bool = True) -> List[str]:
+        """Сгенерировать VLESS конфиги для списка клиентов за один проход
+        
+        use_cache=False для массовой генерации, чтобы не вытеснять из кеша конфиги активных пользователей
+        """
+        try:
+            snapshot = self.get_snapshot()
+            if not snapshot or not snapshot.inbounds:
+                return ["Ошибка получения данных сервера"] * len(clients)
             
-            return config
+            configs = []
+            for client in clients:
+                inbound = snapshot.get_client_inbound(client)
+                protocol = inbound.data.get('protocol') or 'vless'
+                if protocol != 'vless':
+                    configs.append(f"Протокол {protocol} пока не поддерживается")
+                    continue
+                
+                cache_key = (client.id, inbound.version)
+                config = self.config_cache.get(cache_key) if use_cache else None
+                if config is None:
+                    config = self.get_vless_template(inbound).render(client)
+                    if use_cache:
+                        self.config_cache.put(cache_key, config)
+                configs.append(config)
+            return configs
             
         except Exception as e:
             print(f"Ошибка при генерации конфига: {e}")
-            return "Ошибка генерации конфига"
+            return ["Ошибка генерации конфига"] * len(clients)
+    
+    def generate_vless_config(self, client: Client) -> str:
+        """Сгенерировать VLESS конфиг для клиента"""
+        return self.generate_vless_configs([client])[0]
+    
+    def has_json1(self) -> bool:
+        """Проверить, собран ли SQLite с расширением JSON1"""
+        if self._json1_available is None:
+            try:
+                with self.get_connection() as conn:
+                    conn.execute("SELECT json_extract('{\"a\": 1}', '$.a')").fetchone()
+                self._json1_available = True
+            except sqlite3.OperationalError:
+                print("SQLite без JSON1, используется разбор settings в Python")
+                self._json1_available = False
+            except Exception as e:
+                # БД недоступна (например, файла нет) - результат не кешируем, проверим при следующем вызове
+                print(f"Ошибка при проверке JSON1: {e}")
+                return False
+        return self._json1_available
+    
+    def get_user_clients_json1(self, telegram_id: int, limit: Optional[int] = None) -> List[Client]:
+        """Найти клиентов пользователя через JSON1, не разбирая settings всех inbound
+        
+        limit=1 - проверка существования: чтение курсора прекращается на первом подходящем клиенте
+        """
+        clients = []
+        if not telegram_id:
+            return clients  # Клиенты без tgId не принадлежат ни одному пользователю, как и в снимке
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.execute(
+                    """SELECT c.value AS client
+                       FROM inbounds AS i, json_each(i.settings, '$.clients') AS c
+                       WHERE i.enable = 1 AND CAST(json_extract(c.value, '$.tgId') AS INTEGER) = ?
+                       ORDER BY i.id, c.key""",
+                    (telegram_id,)
+                )
+                for row in cursor:
+                    # Та же сверка по Client.tg_id, что и в get_user_menu_rows_json1
+                    client = Client.from_dict(json.loads(row['client']))
+                    if client.tg_id != telegram_id:
+                        continue
+                    clients.append(client)
+                    if limit is not None and len(clients) >= limit:
+                        break
+        except Exception as e:
+            print(f"Ошибка при чтении клиентов через JSON1: {e}")
+        return clients
+    
+    def get_user_menu_rows_json1(self, telegram_id: int) -> List[Tuple[Client, Optional[Tuple[int, int]]]]:
+        """Найти клиентов пользователя и их трафик одним запросом через JSON1"""
+        rows = []
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.execute(
+                    """SELECT c.value AS client, t.up AS up, t.down AS down
+                       FROM inbounds AS i, json_each(i.settings, '$.clients') AS c
+                       LEFT JOIN client_traffics AS t ON t.email = json_extract(c.value, '$.email')
+                       WHERE i.enable = 1 AND CAST(json_extract(c.value, '$.tgId') AS INTEGER) = ?
+                       ORDER BY i.id, c.key""",
+                    (telegram_id,)
+                )
+                for row in cursor:
+                    # tgId может быть строкой: CAST в запросе отбирает кандидатов, а окончательно
+                    # сверяем по Client.tg_id - с тем же приведением, что и при разборе в Python
+                    client = Client.from_dict(json.loads(row['client']))
+                    if client.tg_id != telegram_id:
+                        continue
+                    traffic_stats = (row['up'], row['down']) if row['up'] is not None else None
+                    rows.append((client, traffic_stats))
+        except Exception as e:
+            print(f"Ошибка при чтении клиентов через JSON1: {e}")
+        return rows
+    
+    def build_menu_item(self, client: Client, traffic_stats: Optional[Tuple[int, int]]) -> Dict:
+        """Собрать данные одного клиента для меню"""
+        client_data = {
+            'email': client.email or 'Неизвестно',
+            'client': client,
+            'traffic_stats': traffic_stats
+        }
+        
+        if traffic_stats:
+            up_bytes, down_bytes = traffic_stats
+            client_data['up_gb'] = self.bytes_to_gb(up_bytes)
+            client_data['down_gb'] = self.bytes_to_gb(down_bytes)
+            client_data['total_gb'] = client_data['up_gb'] + client_data['down_gb']
+        
+        return client_data
     
     # Публичные методы для бота
     def get_user_menu_data(self, telegram_id: int) -> List[Dict]:
         """Получить данные для меню пользователя"""
-        user_clients = self.get_user_clients(telegram_id)
-        menu_data = []
+        if self.query_mode == 'json1' and self.has_json1():
+            return [self.build_menu_item(client, traffic_stats) for client, traffic_stats in self.get_user_menu_rows_json1(telegram_id)]
         
-        for client in user_clients:
-            email = client.get('email', 'Неизвестно')
-            traffic_stats = self.get_traffic_stats(email)
-            
-            client_data = {
-                'email': email,
-                'client': client,
-                'traffic_stats': traffic_stats
-            }
-            
-            if traffic_stats:
-                up_bytes, down_bytes = traffic_stats
-                client_data['up_gb'] = self.bytes_to_gb(up_bytes)
-                client_data['down_gb'] = self.bytes_to_gb(down_bytes)
-                client_data['total_gb'] = client_data['up_gb'] + client_data['down_gb']
-            
-            menu_data.append(client_data)
+        user_clients = self.get_user_clients(telegram_id)
+        all_traffic_stats = self.get_traffic_stats_many([client.email for client in user_clients if client.email])
         
-        return menu_data
+        return [self.build_menu_item(client, all_traffic_stats.get(client.email)) for client in user_clients]
     
     def get_client_config(self, telegram_id: int, email: str) -> Optional[str]:
         """Получить конфиг для конкретного клиента"""
-        user_clients = self.get_user_clients(telegram_id)
+        client = self.get_client_by_email(email)
         
-        for client in user_clients:
-            if client.get('email') == email:
-                return self.generate_vless_config(client)
+        if client and client.tg_id == telegram_id:
+            return self.generate_vless_config(client)
         
         return None
     
-    def get_database_hash(self) -> str:
-        """Получить хеш текущего состояния БД для мониторинга изменений"""
+    def _digest_query(self, conn: sqlite3.Connection, query: str) -> str:
+        """Потоково захешировать результат запроса, читая по DIGEST_FETCH_SIZE строк"""
+        digest = hashlib.md5()
+        cursor = conn.execute(query)
+        while True:
+            rows = cursor.fetchmany(DIGEST_FETCH_SIZE)
+            if not rows:
+                break
+            # \x1f и \x1e разделяют поля и строки, поэтому границы значений однозначны.
+            # Большие текстовые поля выбираются как BLOB и хешируются без копирования в str
+            chunk = []
+            for row in rows:
+                for value in row:
+                    if isinstance(value, bytes):
+                        if chunk:
+                            digest.update("".join(chunk).encode('utf-8'))
+                            chunk = []
+                        digest.update(value)
+                        chunk.append("\x1f")
+                    else:
+                        chunk.append(f"{value}\x1f")
+                chunk.append("\x1e")
+            digest.update("".join(chunk).encode('utf-8'))
+        return digest.hexdigest()
+    
+    def get_database_digests(self) -> Dict[str, str]:
+        """Получить раздельные хеши конфигурации (inbound) и счетчиков трафика
+        
+        Мониторинг конфигов может смотреть только на config и не реагировать на постоянно растущий трафик
+        """
         try:
             with self.get_connection() as conn:
-                # Получаем данные из обеих таблиц
-                inbound_cursor = conn.execute("SELECT settings, listen, port, remark, stream_settings FROM inbounds LIMIT 1")
-                inbound_row = inbound_cursor.fetchone()
-                
-                traffic_cursor = conn.execute("SELECT email, up, down FROM client_traffics")
-                traffic_rows = traffic_cursor.fetchall()
-                
-                # Создаем строку для хеширования
-                data_string = ""
-                
-                if inbound_row:
-                    data_string += f"inbound:{inbound_row['settings']}:{inbound_row['listen']}:{inbound_row['port']}:{inbound_row['remark']}:{inbound_row['stream_settings']}"
-                
-                for row in traffic_rows:
-                    data_string += f"traffic:{row['email']}:{row['up']}:{row['down']}"
-                
-                # Возвращаем MD5 хеш
-                return hashlib.md5(data_string.encode('utf-8')).hexdigest()
-                
+                return {
+                    'config': self._digest_query(conn, CONFIG_DIGEST_QUERY),
+                    'traffic': self._digest_query(conn, TRAFFIC_DIGEST_QUERY)
+                }
         except Exception as e:
             print(f"Ошибка при получении хеша БД: {e}")
+            return {'config': "", 'traffic': ""}
+    
+    def get_traffic_summary(self) -> Optional[Tuple]:
+        """Дешевая сводка client_traffics для проверки изменений без чтения строк в Python
+
+        Состав клиентов (email и inbound_id, в том числе переименования) сверяется по md5 их
+        конкатенации, счетчики - по точным целочисленным суммам. Счетчики могут и уменьшаться
+        (сброс в панели), поэтому сброс одного клиента, ровно совпавший с ростом других, сводку
+        не изменит - такая статистика обновится при следующем изменении трафика
+        """
+        try:
+            with self.get_connection() as conn:
+                row = conn.execute(
+                    "SELECT COUNT(*), MAX(rowid), SUM(up), SUM(down), SUM(total), "
+                    "group_concat(email || char(31) || inbound_id, char(30)) FROM client_traffics"
+                ).fetchone()
+            return tuple(row[:5]) + (hashlib.md5((row[5] or "").encode('utf-8')).hexdigest(),)
+        except Exception as e:
+            print(f"Ошибка при получении сводки трафика: {e}")
+            return None
+    
+    def get_database_hash(self) -> str:
+        """Получить хеш текущего состояния БД (конфигурация и трафик) для мониторинга изменений"""
+        digests = self.get_database_digests()
+        if not digests['config']:
             return ""
+        return hashlib.md5(f"{digests['config']}:{digests['traffic']}".encode('utf-8')).hexdigest()
     
     def get_all_user_configs(self) -> Dict[int, List[Dict]]:
         """Получить все конфиги всех пользователей для мониторинга изменений"""
         try:
-            inbound_data = self.get_inbound_data()
-            if not inbound_data or 'clients' not in inbound_data.get('settings', {}):
+            snapshot = self.get_snapshot()
+            if not snapshot:
                 return {}
             
+            clients = [client for client in snapshot.clients if client.tg_id]
+            configs = self.generate_vless_configs(clients, use_cache=False)
+            
             user_configs = {}
             
-            for client in inbound_data['settings']['clients']:
-                tg_id = client.get('tgId')
-                if tg_id:
-                    if tg_id not in user_configs:
-                        user_configs[tg_id] = []
-                    
-                    config_data = {
-                        'email': client.get('email', ''),
-                        'config': self.generate_vless_config(client),
-                        'client_id': client.get('id', ''),
-                        'client_data': client
-                    }
-                    user_configs[tg_id].append(config_data)
+            for client, config in zip(clients, configs):
+                tg_id = client.tg_id
+                if tg_id not in user_configs:
+                    user_configs[tg_id] = []
+                
+                config_data = {
+                    'email': client.email,
+                    'config': config,
+                    'client_id': client.id,
+                    'client_data': client
+                }
+                user_configs[tg_id].append(config_data)
             
             return user_configs
             
@@ -205,88 +872,152 @@ class DatabaseManager:
             print(f"Ошибка при получении всех конфигов: {e}")
             return {}
     
-    def check_config_changes(self, old_configs: Dict[int, List[Dict]]) -> Dict[int, List[Dict]]:
-        """Проверить изменения в конфигах и вернуть обновленные"""
-        current_configs = self.get_all_user_configs()
-        changed_configs = {}
+    def client_fingerprint(self, client: Client) -> int:
+        """Отпечаток полей клиента, из которых собирается конфиг (и его получателя)"""
+        return hash((client.id, client.email, client.tg_id, client.flow))
+    
+    def build_config_fingerprints(self, snapshot: PanelSnapshot) -> Dict:
+        """Собрать отпечатки конфигов по снимку inbound"""
+        return {
+            'inbounds': {inbound_id: hash(self.get_vless_template(inbound).middle('')) for inbound_id, inbound in snapshot.inbounds.items()},
+            'clients': {
+                email: (snapshot.inbound_by_email[email].id, self.client_fingerprint(client))
+                for email, client in snapshot.clients_by_email.items()
+            }
+        }
+    
+    def get_config_fingerprints(self) -> Dict:
+        """Получить текущие отпечатки конфигов для мониторинга изменений"""
+        snapshot = self.get_snapshot()
+        if not snapshot:
+            raise ValueError("Не удалось получить данные inbound")
+        return self.build_config_fingerprints(snapshot)
+    
+    def diff_config_fingerprints(self, old_fingerprints: Dict) -> Tuple[ConfigChanges, Dict]:
+        """Сравнить текущие конфиги с предыдущими отпечатками за один проход
         
-        for tg_id, current_user_configs in current_configs.items():
-            old_user_configs = old_configs.get(tg_id, [])
-            
-            # Проверяем изменения для каждого email пользователя
-            for current_config in current_user_configs:
-                email = current_config['email']
-                
-                # Ищем соответствующий старый конфиг
-                old_config = None
-                for old_cfg in old_user_configs:
-                    if old_cfg['email'] == email:
-                        old_config = old_cfg
-                        break
-                
-                # Если конфиг изменился или это новый конфиг
-                if not old_config or old_config['config'] != current_config['config']:
-                    if tg_id not in changed_configs:
-                        changed_configs[tg_id] = []
-                    changed_configs[tg_id].append(current_config)
+        Возвращает изменения и новые отпечатки, собранные по тому же снимку
+        """
+        snapshot = self.get_snapshot()
+        if not snapshot:
+            # Пустой результат нельзя считать удалением всех клиентов
+            raise ValueError("Не удалось получить данные inbound")
+        
+        new_fingerprints = self.build_config_fingerprints(snapshot)
+        old_clients = old_fingerprints.get('clients', {})
+        
+        # Смена общих параметров inbound (SNI, pbk и т.д.) меняет конфиги всех его клиентов
+        old_inbounds = old_fingerprints.get('inbounds', {})
+        changed_inbounds = {
+            inbound_id for inbound_id, fingerprint in new_fingerprints['inbounds'].items()
+            if old_inbounds.get(inbound_id) != fingerprint
+        }
         
-        return changed_configs
+        changes = ConfigChanges()
+        for email, fingerprint in new_fingerprints['clients'].items():
+            old_fingerprint = old_clients.get(email)
+            if old_fingerprint is None:
+                changes.added.append(snapshot.clients_by_email[email])
+            elif fingerprint[0] in changed_inbounds or old_fingerprint != fingerprint:
+                changes.modified.append(snapshot.clients_by_email[email])
+        
+        changes.removed = [email for email in old_clients if email not in new_fingerprints['clients']]
+        
+        return changes, new_fingerprints
     
     def get_all_unique_telegram_ids(self) -> List[int]:
         """Получить все уникальные Telegram ID пользователей из БД"""
-        try:
-            inbound_data = self.get_inbound_data()
-            if not inbound_data or 'clients' not in inbound_data.get('settings', {}):
-                return []
-            
-            telegram_ids = set()
-            for client in inbound_data['settings']['clients']:
-                tg_id = client.get('tgId')
-                if tg_id:
-                    telegram_ids.add(tg_id)
-            
-            return list(telegram_ids)
-            
-        except Exception as e:
-            print(f"Ошибка при получении уникальных Telegram ID: {e}")
+        snapshot = self.get_snapshot()
+        if not snapshot:
             return []
+        
+        return list(snapshot.clients_by_tg_id)
     
-    def get_all_clients(self) -> List[Dict]:
-        """Получить всех клиентов из БД"""
-        try:
-            inbound_data = self.get_inbound_data()
-            if not inbound_data or 'clients' not in inbound_data.get('settings', {}):
-                return []
-            
-            return inbound_data['settings']['clients']
-            
-        except Exception as e:
-            print(f"Ошибка при получении всех клиентов: {e}")
+    def get_all_clients(self) -> List[Client]:
+        """Получить всех клиентов всех включенных inbound"""
+        snapshot = self.get_snapshot()
+        if not snapshot:
             return []
+        
+        return list(snapshot.clients)
     
-    def get_inbound_remark(self) -> str:
-        """Получить remark инбаунда"""
+    def get_inbound_remark(self, email: Optional[str] = None) -> str:
+        """Получить remark инбаунда клиента (или первого инбаунда, если email не указан)"""
         try:
-            inbound_data = self.get_inbound_data()
-            if inbound_data:
-                return inbound_data.get('remark', 'Unknown')
+            snapshot = self.get_snapshot()
+            if snapshot and snapshot.inbounds:
+                inbound = snapshot.inbound_by_email.get(email) if email else None
+                inbound = inbound or next(iter(snapshot.inbounds.values()))
+                return inbound.data.get('remark', 'Unknown')
         except Exception as e:
             print(f"Ошибка при получении remark инбаунда: {e}")
         return 'Unknown'
+
+# Настройки асинхронного доступа к БД
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '4'))
+DB_CALL_TIMEOUT = float(os.getenv('DB_CALL_TIMEOUT', '10'))  # Секунды на один вызов
+
+_NO_DEFAULT = object()
+
+class AsyncDatabaseManager:
+    """Асинхронная обертка над DatabaseManager: запросы выполняются в выделенном пуле потоков"""
+    def __init__(self, db: DatabaseManager, max_workers: int = DB_EXECUTOR_WORKERS, timeout: float = DB_CALL_TIMEOUT):
+        self.db = db
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+        self.stats = {'calls': 0, 'timeouts': 0}
     
-    def check_new_clients(self, old_clients: List[Dict]) -> List[Dict]:
-        """Проверить появление новых клиентов"""
-        current_clients = self.get_all_clients()
-        new_clients = []
+    async def run(self, func, *args, default=_NO_DEFAULT):
+        """Выполнить синхронный вызов БД вне event loop с таймаутом
         
-        # Создаем множество email существующих клиентов
-        old_emails = {client.get('email', '') for client in old_clients}
-        
-        # Ищем новых клиентов
-        for client in current_clients:
-            email = client.get('email', '')
-            if email and email not in old_emails:
-                new_clients.append(client)
-        
-        return new_clients
-    
\ No newline at end of file
+        Если передан default, при таймауте возвращается он, иначе пробрасывается asyncio.TimeoutError
+        """
+        loop = asyncio.get_running_loop()
+        self.stats['calls'] += 1
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, func, *args), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            print(f"Таймаут запроса к БД: {getattr(func, '__name__', func)}")
+            if default is _NO_DEFAULT:
+                raise
+            return default
+    
+    def shutdown(self):
+        """Остановить пул потоков"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    # Методы для обработчиков: при таймауте возвращают безопасное значение по умолчанию
+    async def is_user_authorized(self, telegram_id: int) -> bool:
+        return await self.run(self.db.is_user_authorized, telegram_id, default=False)
+    
+    async def get_user_clients(self, telegram_id: int) -> List[Client]:
+        return await self.run(self.db.get_user_clients, telegram_id, default=[])
+    
+    async def get_user_menu_data(self, telegram_id: int) -> List[Dict]:
+        return await self.run(self.db.get_user_menu_data, telegram_id, default=[])
+    
+    async def get_client_by_id(self, client_id: str) -> Optional[Client]:
+        return await self.run(self.db.get_client_by_id, client_id, default=None)
+    
+    async def generate_vless_configs(self, clients: List[Client], use_cache: bool = True) -> List[str]:
+        return await self.run(self.db.generate_vless_configs, clients, use_cache, default=["Ошибка генерации конфига"] * len(clients))
+    
+    async def generate_vless_config(self, client: Client) -> str:
+        return await self.run(self.db.generate_vless_config, client, default="Ошибка генерации конфига")
+    
+    async def get_all_unique_telegram_ids(self) -> List[int]:
+        return await self.run(self.db.get_all_unique_telegram_ids, default=[])
+    
+    async def get_inbound_remark(self, email: Optional[str] = None) -> str:
+        return await self.run(self.db.get_inbound_remark, email, default='Unknown')
+    
+    # Методы для мониторинга: таймаут пробрасывается, чтобы не принять пустой результат за изменения
+    async def get_snapshot_version(self) -> int:
+        return await self.run(self.db.get_snapshot_version)
+    
+    async def get_config_fingerprints(self) -> Dict:
+        return await self.run(self.db.get_config_fingerprints)
+    
+    async def diff_config_fingerprints(self, old_fingerprints: Dict) -> Tuple[ConfigChanges, Dict]:
+        return await self.run(self.db.diff_config_fingerprints, old_fingerprints)
@@ -0,0 +1,155 @@
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Время жизни собранного меню пользователя (секунды)
+MENU_CACHE_TTL = float(os.getenv('MENU_CACHE_TTL', '10'))
+# Максимум отрисованных вариантов меню в памяти
+MENU_RENDER_CACHE_SIZE = int(os.getenv('MENU_RENDER_CACHE_SIZE', '1024'))
+
+@dataclass(frozen=True, slots=True)
+class MenuItem:
+    """Строка меню: один клиент пользователя"""
+    email: str
+    traffic_stats: Optional[Tuple[int, int]]  # (up, down) в байтах, None - статистики нет
+    up_gb: float = 0.0
+    down_gb: float = 0.0
+    total_gb: float = 0.0
+    today_gb: Optional[float] = None  # По истории замеров трафика, None - истории нет
+    week_gb: Optional[float] = None
+
+@dataclass(frozen=True, slots=True)
+class MenuView:
+    """Данные меню пользователя, из которых однозначно отрисовываются текст и клавиатура"""
+    items: Tuple[MenuItem, ...]
+    is_admin: bool
+
+    @property
+    def first_email(self) -> str:
+        return self.items[0].email
+
+def build_menu_view(menu_data: List[Dict], is_admin: bool,
+                    usage: Optional[Dict[str, Tuple[float, float]]] = None) -> MenuView:
+    """Собрать модель меню из данных get_user_menu_data
+
+    usage - трафик за сегодня и за неделю в GB по email (из истории замеров)
+    """
+    usage = usage or {}
+    items = tuple(
+        MenuItem(
+            email=client_data['email'],
+            traffic_stats=client_data['traffic_stats'],
+            up_gb=client_data.get('up_gb', 0.0),
+            down_gb=client_data.get('down_gb', 0.0),
+            total_gb=client_data.get('total_gb', 0.0),
+            today_gb=usage.get(client_data['email'], (None, None))[0],
+            week_gb=usage.get(client_data['email'], (None, None))[1]
+        )
+        for client_data in menu_data
+    )
+    return MenuView(items, is_admin)
+
+@lru_cache(maxsize=MENU_RENDER_CACHE_SIZE)
+def render_menu_text(view: MenuView) -> Tuple[str, str]:
+    """Отрисовать текст меню: часть до времени обновления и часть после"""
+    # Объединяем информацию о всех клиентах в одно сообщение
+    messages = []
+    for item in view.items:
+        if item.traffic_stats:
+            message = f"👤 **{item.email}**\n\n"
+            message += f"🔼 Исходящий трафик: ↑{round(item.up_gb, 3)}GB\n"
+            message += f"🔽 Входящий трафик: ↓{round(item.down_gb, 3)}GB\n"
+            message += f"📊 Всего: ↑↓{round(item.total_gb, 3)}GB"
+            if item.today_gb is not None:
+                message += f"\n📅 Сегодня: ↑↓{round(item.today_gb, 3)}GB, за неделю: ↑↓{round(item.week_gb, 3)}GB"
+        else:
+            message = f"👤 **{item.email}**\n\n"
+            message += "📊 Статистика трафика недоступна"
+
+        messages.append(message)
+
+    body = "\n\n".join(messages)
+
+    # Добавляем информацию о команде /report
+    footer = f"\n\n📝 Используйте /report для сообщения о проблемах"
+
+    # Добавляем админские команды для администраторов
+    if view.is_admin:
+        footer += f"\n\n🔐 **Админские команды:**\n"
+        footer += f"📢 /mail - рассылка сообщений всем пользователям\n"
+        footer += f"📋 /jobs - статус рассылок\n"
+        footer += f"📊 /metrics - метрики кешей\n"
+        footer += f"📈 /stats - статистика трафика\n"
+        footer += f"📝 /report - создание отчета о проблеме"
+
+    return body, footer
+
+@lru_cache(maxsize=MENU_RENDER_CACHE_SIZE)
+def render_menu_keyboard(view: MenuView) -> InlineKeyboardMarkup:
+    """Отрисовать клавиатуру меню (кнопки для первого клиента)"""
+    keyboard = [
+        [InlineKeyboardButton("📄 Мой конфиг", callback_data=f"config_{view.first_email}")],
+        [InlineKeyboardButton("📈 График", callback_data="chart")],
+        [InlineKeyboardButton("🔄 Обновить", callback_data=f"refresh_{view.first_email}")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def render_menu(view: MenuView, now: Optional[datetime] = None) -> Tuple[str, InlineKeyboardMarkup]:
+    """Отрисовать меню целиком: текст с временем обновления и клавиатуру"""
+    body, footer = render_menu_text(view)
+    current_time = (now or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+    return f"{body}\n\n📋🔄 Обновлено: {current_time}{footer}", render_menu_keyboard(view)
+
+class MenuCache:
+    """Кеш моделей меню по user_id с коротким TTL и сбросом по изменению трафика"""
+    def __init__(self, ttl: float = MENU_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[int, Tuple[float, MenuView]] = {}
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: int) -> Optional[MenuView]:
+        """Получить модель меню, если она еще актуальна"""
+        entry = self._entries.get(user_id)
+        if entry and entry[0] > time.monotonic():
+            self.stats['hits'] += 1
+            return entry[1]
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, user_id: int, view: MenuView):
+        """Сохранить модель меню"""
+        self._entries[user_id] = (time.monotonic() + self.ttl, view)
+
+    def prune(self):
+        """Удалить устаревшие записи"""
+        now = time.monotonic()
+        for user_id in [user_id for user_id, (expires, _) in self._entries.items() if expires <= now]:
+            del self._entries[user_id]
+
+    def emails(self) -> List[str]:
+        """Email всех клиентов в кешированных меню"""
+        return [item.email for _, view in self._entries.values() for item in view.items]
+
+    def drop_changed(self, traffic: Dict[str, Tuple[int, int]]):
+        """Сбросить меню, в которых трафик отличается от актуального"""
+        for user_id, (_, view) in list(self._entries.items()):
+            if any(traffic.get(item.email) != item.traffic_stats for item in view.items):
+                del self._entries[user_id]
+                self.stats['invalidations'] += 1
+
+    def invalidate(self, user_ids: Optional[Iterable[int]] = None):
+        """Сбросить меню указанных пользователей (по умолчанию всех)"""
+        if user_ids is None:
+            self.stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+            return
+        for user_id in user_ids:
+            if self._entries.pop(user_id, None) is not None:
+                self.stats['invalidations'] += 1
@@ -0,0 +1,79 @@
+import io
+import os
+import asyncio
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+from database import LRUCache
+
+# Процессы для рендера QR (рендер нагружает CPU и не должен блокировать event loop)
+QR_RENDER_WORKERS = int(os.getenv('QR_RENDER_WORKERS', '2'))
+# Максимум готовых PNG в памяти
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', '256'))
+
+# Модули с функциями рендера: их заранее импортирует сервер forkserver
+RENDER_MODULES = ['qr', 'charts']
+
+def create_render_pool(workers: int) -> ProcessPoolExecutor:
+    """Пул процессов для рендера медиа (QR, графики)
+
+    Сервер forkserver импортирует только модули рендера, но сами воркеры по правилам
+    multiprocessing все равно импортируют основной модуль (bot.py) как __mp_main__,
+    поэтому импорт bot.py не должен открывать соединения (хранилища подключаются лениво)
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(max_workers=workers)
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(RENDER_MODULES)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+def render_qr_png(data: str) -> bytes:
+    """Нарисовать QR код в PNG (выполняется в отдельном процессе)"""
+    import qrcode
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=8, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    image = qr.make_image(fill_color="black", back_color="white")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def content_hash(data: str) -> str:
+    """Хеш содержимого для ключей кешей"""
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+class QRRenderer:
+    """Рендер QR кодов конфигов в пуле процессов с кешем PNG"""
+    def __init__(self, workers: int = QR_RENDER_WORKERS, cache_size: int = QR_CACHE_SIZE):
+        self.workers = workers
+        self.png_cache = LRUCache(cache_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Пул процессов создается при первом запросе QR"""
+        if self._executor is None:
+            self._executor = create_render_pool(self.workers)
+        return self._executor
+
+    async def render(self, config: str) -> bytes:
+        """Получить PNG QR кода для конфига (из кеша или отрендерив в пуле процессов)"""
+        key = content_hash(config)
+        png = self.png_cache.get(key)
+        if png is None:
+            loop = asyncio.get_running_loop()
+            png = await loop.run_in_executor(self._get_executor(), render_qr_png, config)
+            self.png_cache.put(key, png)
+        return png
+
+    def get_stats(self) -> Dict:
+        """Получить метрики кеша QR"""
+        return self.png_cache.get_stats()
+
+    def shutdown(self):
+        """Остановить пул процессов"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
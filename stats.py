@@ -0,0 +1,129 @@
+import os
+import math
+import heapq
+import bisect
+import operator
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+from database import DatabaseManager, DIGEST_FETCH_SIZE
+
+# Сколько пользователей показывать в топе
+STATS_TOP_N = int(os.getenv('STATS_TOP_N', '10'))
+# Доля квоты, начиная с которой клиент считается близким к лимиту
+STATS_QUOTA_THRESHOLD = float(os.getenv('STATS_QUOTA_THRESHOLD', '0.9'))
+
+class TrafficColumns:
+    """Счетчики client_traffics в колоночном виде: по массиву на столбец"""
+    __slots__ = ('emails', 'inbound_ids', 'up', 'down', 'total')
+
+    def __init__(self):
+        self.emails: List[str] = []
+        self.inbound_ids = array('q')
+        self.up = array('q')
+        self.down = array('q')
+        self.total = array('q')  # Квота в байтах, 0 - без ограничения
+
+    def __len__(self) -> int:
+        return len(self.emails)
+
+    @classmethod
+    def load(cls, db: DatabaseManager) -> 'TrafficColumns':
+        """Загрузить всю таблицу одним запросом"""
+        columns = cls()
+        with db.get_connection() as conn:
+            cursor = conn.execute("SELECT email, inbound_id, up, down, total FROM client_traffics")
+            while True:
+                rows = cursor.fetchmany(DIGEST_FETCH_SIZE)
+                if not rows:
+                    break
+                for email, inbound_id, up, down, total in rows:
+                    columns.emails.append(email)
+                    columns.inbound_ids.append(inbound_id or 0)
+                    columns.up.append(up or 0)
+                    columns.down.append(down or 0)
+                    columns.total.append(total or 0)
+        return columns
+
+def percentile(sorted_values: List[int], fraction: float) -> int:
+    """Перцентиль отсортированного списка (ближайший ранг)"""
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def compute_traffic_stats(columns: TrafficColumns, top_n: int = STATS_TOP_N,
+                          quota_threshold: float = STATS_QUOTA_THRESHOLD) -> Dict:
+    """Посчитать сводную статистику трафика по колонкам
+
+    Суммы, топ и перцентили считаются встроенными функциями по массивам;
+    разбивка по inbound и поиск близких к квоте - один проход по строкам в Python
+    """
+    used = array('q', map(operator.add, columns.up, columns.down))
+
+    # Топ по суммарному трафику
+    top_indexes = heapq.nlargest(top_n, range(len(used)), key=used.__getitem__)
+
+    sorted_used = sorted(used)
+
+    per_inbound: Dict[int, int] = {}
+    for inbound_id, value in zip(columns.inbound_ids, used):
+        per_inbound[inbound_id] = per_inbound.get(inbound_id, 0) + value
+
+    # Близкие к квоте: used / total >= порога (только клиенты с ограничением)
+    near_quota = [
+        (columns.emails[index], used[index], columns.total[index])
+        for index, (value, total) in enumerate(zip(used, columns.total))
+        if total > 0 and value >= total * quota_threshold
+    ]
+    near_quota.sort(key=lambda item: item[1] / item[2], reverse=True)
+
+    return {
+        'clients': len(columns),
+        'up': sum(columns.up),
+        'down': sum(columns.down),
+        'total': sum(used),
+        'active': len(used) - bisect.bisect_right(sorted_used, 0),
+        'top': [(columns.emails[index], used[index]) for index in top_indexes],
+        'percentiles': {name: percentile(sorted_used, fraction) for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))},
+        'per_inbound': per_inbound,
+        'near_quota': near_quota
+    }
+
+class TrafficStatsEngine:
+    """Статистика трафика для администраторов с кешем до изменения данных трафика"""
+    def __init__(self, db: DatabaseManager):
+        self.db = db
+        self._lock = threading.Lock()
+        self._signature: Optional[Tuple] = None
+        self._summary: Optional[Tuple] = None
+        self._result: Optional[Dict] = None
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get_stats(self) -> Optional[Dict]:
+        """Получить статистику (пересчитывается, только если изменился трафик)"""
+        with self._lock:
+            # Файл БД не менялся - трафик точно тот же
+            signature = self.db.get_db_signature()
+            if self._result is not None and signature == self._signature:
+                self.stats['hits'] += 1
+                return self._result
+
+            # Файл менялся, но могли измениться только inbound - сверяем дешевую сводку трафика
+            summary = self.db.get_traffic_summary()
+            if self._result is not None and summary is not None and summary == self._summary:
+                self._signature = signature
+                self.stats['hits'] += 1
+                return self._result
+
+            try:
+                columns = TrafficColumns.load(self.db)
+            except Exception as e:
+                print(f"Ошибка при чтении статистики трафика: {e}")
+                return None
+
+            self.stats['misses'] += 1
+            self._result = compute_traffic_stats(columns)
+            self._signature = signature
+            self._summary = summary
+            return self._result
@@ -0,0 +1,357 @@
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Собственная БД бота (x-ui.db открывается только на чтение)
+BOT_DATA_PATH = os.getenv('BOT_DATA_PATH', 'data/bot.db')
+
+class LocalStorage:
+    """Базовый класс для хранилищ в собственной SQLite БД бота"""
+    SCHEMA = ""
+
+    def __init__(self, db_path: str = BOT_DATA_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Соединение открывается при первом обращении
+
+        Импорт bot.py (в том числе повторный в процессах пулов рендера) не должен
+        открывать БД и писать в нее схему
+        """
+        if self._connection is None:
+            with self._connect_lock:
+                if self._connection is None:
+                    directory = os.path.dirname(os.path.abspath(self.db_path))
+                    os.makedirs(directory, exist_ok=True)
+
+                    conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                    conn.row_factory = sqlite3.Row
+                    conn.execute("PRAGMA journal_mode = WAL")
+                    conn.execute("PRAGMA synchronous = NORMAL")
+                    with conn:
+                        conn.executescript(self.SCHEMA)
+                    self._connection = conn
+        return self._connection
+
+    def close(self):
+        """Закрыть соединение"""
+        with self._lock, self._connect_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+class BroadcastStore(LocalStorage):
+    """Персистентная очередь рассылок со статусом по каждому получателю
+
+    Статусы получателя: pending -> sending -> sent/failed. Если бот упал между отправкой
+    и записью результата, получатель остается в sending и при возобновлении помечается
+    как unknown - повторно ему не отправляем, чтобы не было дублей.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            admin_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            status_message_id INTEGER,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            job_id INTEGER NOT NULL,
+            tg_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            PRIMARY KEY (job_id, tg_id)
+        );
+    """
+
+    def create_job(self, text: str, admin_id: int, chat_id: int, status_message_id: Optional[int], telegram_ids: List[int]) -> int:
+        """Создать задание рассылки и вернуть его ID"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO broadcast_jobs (text, admin_id, chat_id, status_message_id, created_at) VALUES (?, ?, ?, ?, ?)",
+                (text, admin_id, chat_id, status_message_id, time.time())
+            )
+            job_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO broadcast_recipients (job_id, tg_id) VALUES (?, ?)",
+                ((job_id, tg_id) for tg_id in telegram_ids)
+            )
+        return job_id
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        """Получить задание по ID"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_running_jobs(self) -> List[Dict]:
+        """Получить незавершенные задания"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM broadcast_jobs WHERE status = 'running' ORDER BY id").fetchall()
+        return [dict(row) for row in rows]
+
+    def get_recent_jobs(self, limit: int = 10) -> List[Dict]:
+        """Получить последние задания"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM broadcast_jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_pending_recipients(self, job_id: int) -> List[int]:
+        """Получить получателей, которым еще не отправляли"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT tg_id FROM broadcast_recipients WHERE job_id = ? AND status = 'pending'", (job_id,)
+            ).fetchall()
+        return [row['tg_id'] for row in rows]
+
+    def get_job_counts(self, job_id: int) -> Dict[str, int]:
+        """Получить количество получателей по статусам"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS count FROM broadcast_recipients WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall()
+        return {row['status']: row['count'] for row in rows}
+
+    def mark_interrupted(self, job_id: int):
+        """Пометить отправки, прерванные падением бота, как unknown"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE broadcast_recipients SET status = 'unknown' WHERE job_id = ? AND status = 'sending'", (job_id,)
+            )
+
+    def mark_sending(self, job_id: int, tg_id: int):
+        """Отметить начало отправки получателю"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE broadcast_recipients SET status = 'sending' WHERE job_id = ? AND tg_id = ?", (job_id, tg_id)
+            )
+
+    def mark_result(self, job_id: int, tg_id: int, success: bool, error: Optional[str] = None):
+        """Записать результат отправки получателю"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE broadcast_recipients SET status = ?, error = ? WHERE job_id = ? AND tg_id = ?",
+                ('sent' if success else 'failed', error, job_id, tg_id)
+            )
+
+    def finish_job(self, job_id: int, status: str = 'done'):
+        """Завершить задание (done или cancelled)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE broadcast_jobs SET status = ?, finished_at = ? WHERE id = ? AND status = 'running'",
+                (status, time.time(), job_id)
+            )
+
+class FileIdStore(LocalStorage):
+    """Telegram file_id уже загруженных медиа по хешу содержимого
+
+    Ключ - хеш данных, из которых рендерится медиа (например, текста конфига для QR),
+    поэтому при попадании не нужно ни рендерить, ни загружать файл повторно.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS media_file_ids (
+            content_hash TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+    """
+
+    def get(self, content_hash: str) -> Optional[str]:
+        """Получить file_id по хешу содержимого"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id FROM media_file_ids WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return row['file_id'] if row else None
+
+    def put(self, content_hash: str, file_id: str):
+        """Сохранить file_id загруженного медиа"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media_file_ids (content_hash, file_id, created_at) VALUES (?, ?, ?)",
+                (content_hash, file_id, time.time())
+            )
+
+    def forget(self, content_hash: str):
+        """Удалить file_id, который Telegram больше не принимает"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM media_file_ids WHERE content_hash = ?", (content_hash,))
+
+    def count(self) -> int:
+        """Количество сохраненных file_id"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM media_file_ids").fetchone()[0]
+
+# Интервал снятия счетчиков трафика и срок хранения истории
+TRAFFIC_SAMPLE_INTERVAL = float(os.getenv('TRAFFIC_SAMPLE_INTERVAL', '300'))
+TRAFFIC_HISTORY_DAYS = int(os.getenv('TRAFFIC_HISTORY_DAYS', '35'))
+
+def day_start(ts: float) -> int:
+    """Начало локальных суток, в которые попадает ts"""
+    return int(datetime.fromtimestamp(ts).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+class TrafficHistoryStore(LocalStorage):
+    """История трафика клиентов: приращения счетчиков client_traffics между замерами
+
+    Хранятся только ненулевые приращения (delta-кодирование), таблица кластеризована
+    по (email, ts), поэтому выборка за период по пользователю - это короткий диапазон индекса.
+    Дополнительно приращения сразу суммируются по дням (traffic_daily) для графиков.
+    Если панель сбросила счетчик (новое значение меньше прежнего), приращением считается
+    новое значение целиком - трафик, набранный после сброса.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS traffic_samples (
+            email TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            up INTEGER NOT NULL,
+            down INTEGER NOT NULL,
+            PRIMARY KEY (email, ts)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS traffic_daily (
+            email TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            up INTEGER NOT NULL,
+            down INTEGER NOT NULL,
+            PRIMARY KEY (email, day)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS traffic_counters (
+            email TEXT PRIMARY KEY,
+            up INTEGER NOT NULL,
+            down INTEGER NOT NULL,
+            ts INTEGER NOT NULL
+        ) WITHOUT ROWID;
+    """
+
+    _last_prune = 0
+
+    def record(self, counters: Dict[str, Tuple[int, int]], ts: Optional[int] = None) -> int:
+        """Сохранить замер счетчиков (up, down) всех клиентов, вернуть число записанных приращений"""
+        ts = int(ts if ts is not None else time.time())
+        with self._lock, self._conn:
+            last = {
+                row['email']: (row['up'], row['down'])
+                for row in self._conn.execute("SELECT email, up, down FROM traffic_counters")
+            }
+
+            samples = []
+            for email, (up, down) in counters.items():
+                previous = last.get(email)
+                if previous is None:
+                    # Первый замер клиента - только точка отсчета
+                    continue
+                delta_up = up - previous[0] if up >= previous[0] else up
+                delta_down = down - previous[1] if down >= previous[1] else down
+                if delta_up or delta_down:
+                    samples.append((email, ts, delta_up, delta_down))
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO traffic_samples (email, ts, up, down) VALUES (?, ?, ?, ?)", samples
+            )
+            day = day_start(ts)
+            self._conn.executemany(
+                """INSERT INTO traffic_daily (email, day, up, down) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (email, day) DO UPDATE SET up = up + excluded.up, down = down + excluded.down""",
+                ((email, day, delta_up, delta_down) for email, _, delta_up, delta_down in samples)
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO traffic_counters (email, up, down, ts) VALUES (?, ?, ?, ?)",
+                ((email, up, down, ts) for email, (up, down) in counters.items())
+            )
+            # Очистка старой истории требует полного прохода по таблице, поэтому не чаще раза в час
+            if ts - self._last_prune >= 3600:
+                self._conn.execute("DELETE FROM traffic_samples WHERE ts < ?", (ts - TRAFFIC_HISTORY_DAYS * 86400,))
+                self._conn.execute("DELETE FROM traffic_daily WHERE day < ?", (ts - TRAFFIC_HISTORY_DAYS * 86400,))
+                self._last_prune = ts
+        return len(samples)
+
+    def get_usage(self, emails: List[str], since: float, until: Optional[float] = None) -> Dict[str, Tuple[int, int]]:
+        """Трафик (up, down) клиентов за период [since, until)"""
+        if not emails:
+            return {}
+        until = until if until is not None else time.time() + 1
+        placeholders = ",".join("?" * len(emails))
+        with self._lock:
+            rows = self._conn.execute(
+                f"""SELECT email, SUM(up) AS up, SUM(down) AS down FROM traffic_samples
+                    WHERE email IN ({placeholders}) AND ts >= ? AND ts < ? GROUP BY email""",
+                (*emails, int(since), int(until))
+            ).fetchall()
+        return {row['email']: (row['up'], row['down']) for row in rows}
+
+    def get_tracked(self, emails: List[str]) -> Set[str]:
+        """Email клиентов, для которых уже есть точка отсчета (история ведется)"""
+        if not emails:
+            return set()
+        placeholders = ",".join("?" * len(emails))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT email FROM traffic_counters WHERE email IN ({placeholders})", emails
+            ).fetchall()
+        return {row['email'] for row in rows}
+
+    def get_daily_usage(self, emails: List[str], since_day: int) -> Dict[int, Tuple[int, int]]:
+        """Суммарный трафик (up, down) клиентов по дням начиная с since_day"""
+        if not emails:
+            return {}
+        placeholders = ",".join("?" * len(emails))
+        with self._lock:
+            rows = self._conn.execute(
+                f"""SELECT day, SUM(up) AS up, SUM(down) AS down FROM traffic_daily
+                    WHERE email IN ({placeholders}) AND day >= ? GROUP BY day""",
+                (*emails, since_day)
+            ).fetchall()
+        return {row['day']: (row['up'], row['down']) for row in rows}
+
+# Ключ отправленного предупреждения: (email, вид, стадия, период)
+AlertKey = Tuple[str, str, int, int]
+
+class AlertStore(LocalStorage):
+    """Отправленные предупреждения о квоте трафика и окончании подписки (защита от повторов)
+
+    period - значение, к которому относится предупреждение: квота в байтах или время окончания
+    подписки. После смены квоты или продления подписки предупреждения отправляются заново.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sent_alerts (
+            email TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            stage INTEGER NOT NULL,
+            period INTEGER NOT NULL,
+            sent_at REAL NOT NULL,
+            PRIMARY KEY (email, kind, stage, period)
+        ) WITHOUT ROWID;
+    """
+
+    def load(self) -> Set[AlertKey]:
+        """Все отправленные предупреждения"""
+        with self._lock:
+            rows = self._conn.execute("SELECT email, kind, stage, period FROM sent_alerts").fetchall()
+        return {tuple(row) for row in rows}
+
+    def mark(self, keys: Iterable[AlertKey]):
+        """Отметить предупреждения отправленными"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO sent_alerts (email, kind, stage, period, sent_at) VALUES (?, ?, ?, ?, ?)",
+                ((*key, time.time()) for key in keys)
+            )
+
+    def forget(self, keys: Iterable[AlertKey]):
+        """Снова разрешить предупреждения (например, после сброса счетчика трафика)"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM sent_alerts WHERE email = ? AND kind = ? AND stage = ? AND period = ?", keys
+            )
@@ -0,0 +1,194 @@
+import os
+import sys
+import struct
+import ctypes
+import ctypes.util
+import asyncio
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Интервал опроса сигнатуры файла, если inotify недоступен
+WATCH_POLL_INTERVAL = float(os.getenv('WATCH_POLL_INTERVAL', '0.5'))
+# Пауза после события, чтобы дождаться окончания серии записей 3x-ui
+WATCH_DEBOUNCE = float(os.getenv('WATCH_DEBOUNCE', '0.2'))
+# Страховочная проверка сигнатуры даже при работающем inotify
+WATCH_SAFETY_INTERVAL = float(os.getenv('WATCH_SAFETY_INTERVAL', '30'))
+
+# Константы inotify из <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# Маска для самих файлов БД и -wal: запись через другую запись каталога (bind mount одного файла)
+# не порождает событий в каталоге контейнера, но видна на inode файла
+FILE_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+class DatabaseWatcher:
+    """Отслеживание изменений файла БД и его -wal через inotify с откатом на опрос сигнатуры"""
+    def __init__(self, db_path: str, get_signature: Callable[[], Tuple], poll_interval: float = WATCH_POLL_INTERVAL):
+        self.db_path = db_path
+        self.get_signature = get_signature
+        self.poll_interval = poll_interval
+
+        db_name = os.path.basename(db_path)
+        self._watched_names = {db_name, db_name + '-wal', db_name + '-journal'}
+        self._fd: Optional[int] = None
+        self._libc = None
+        self._dir_wd: Optional[int] = None
+        self._file_watches: Dict[int, str] = {}  # wd -> путь файла
+        self._watched_inodes: Tuple = ()
+        self._event = asyncio.Event()
+        self._last_signature = get_signature()
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+
+    def start(self):
+        """Подключить inotify к текущему event loop (если доступен)"""
+        if not sys.platform.startswith('linux'):
+            logger.info("inotify недоступен, используется опрос файла БД")
+            return
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1")
+
+            # Следим за каталогом: панель может пересоздавать файл БД и -wal
+            directory = os.path.dirname(os.path.abspath(self.db_path)).encode()
+            self._dir_wd = libc.inotify_add_watch(fd, directory, WATCH_MASK)
+            if self._dir_wd < 0:
+                error = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(error, "inotify_add_watch")
+
+            asyncio.get_running_loop().add_reader(fd, self._on_inotify_event)
+            self._fd = fd
+            self._libc = libc
+            # И за самими файлами: при bind mount одного файла события каталога не приходят
+            self._add_file_watches()
+            logger.info("Отслеживание изменений БД через inotify")
+        except Exception as e:
+            logger.warning(f"Не удалось включить inotify, используется опрос файла БД: {e}")
+
+    def close(self):
+        """Отключить inotify"""
+        if self._fd is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self._fd)
+            except RuntimeError:
+                pass
+            os.close(self._fd)
+            self._fd = None
+            self._file_watches.clear()
+
+    def _file_inodes(self) -> Tuple:
+        """Inode файла БД и -wal (None - файла нет)"""
+        inodes = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                inodes.append(os.stat(path).st_ino)
+            except OSError:
+                inodes.append(None)
+        return tuple(inodes)
+
+    def _add_file_watches(self):
+        """Поставить (или обновить после замены файла) наблюдение за файлом БД и -wal"""
+        if self._fd is None:
+            return
+        self._watched_inodes = self._file_inodes()
+        for path in (self.db_path, self.db_path + '-wal'):
+            if not os.path.exists(path):
+                continue
+            # Для того же inode ядро вернет прежний wd, для нового файла - новый
+            wd = self._libc.inotify_add_watch(self._fd, os.path.abspath(path).encode(), FILE_WATCH_MASK)
+            if wd < 0:
+                continue
+            # Наблюдение за прежним (замененным) inode больше не нужно
+            for old_wd in [old for old, old_path in self._file_watches.items() if old_path == path and old != wd]:
+                self._libc.inotify_rm_watch(self._fd, old_wd)
+                del self._file_watches[old_wd]
+            self._file_watches[wd] = path
+
+    def _on_inotify_event(self):
+        """Прочитать события inotify и отметить изменение, если оно касается файлов БД"""
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        rewatch = False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0').decode(errors='replace')
+            offset += name_length
+
+            if wd in self._file_watches:
+                self._event.set()
+                if mask & IN_IGNORED:
+                    # Файл удален - ядро уже сняло наблюдение
+                    del self._file_watches[wd]
+                    rewatch = True
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    # Файл заменен: наблюдение осталось на старом inode
+                    self._libc.inotify_rm_watch(self._fd, wd)
+                    self._file_watches.pop(wd, None)
+                    rewatch = True
+            elif wd == self._dir_wd and name in self._watched_names:
+                self._event.set()
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    rewatch = True
+
+        if rewatch:
+            self._add_file_watches()
+
+    async def wait_for_change(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться изменения файла БД
+
+        Возвращает True, если сигнатура файла изменилась, и False по истечении timeout
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+
+        while True:
+            wait = WATCH_SAFETY_INTERVAL if self.uses_inotify else self.poll_interval
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+
+            if self.uses_inotify:
+                try:
+                    await asyncio.wait_for(self._event.wait(), wait)
+                    await asyncio.sleep(WATCH_DEBOUNCE)
+                except asyncio.TimeoutError:
+                    pass
+                self._event.clear()
+            else:
+                await asyncio.sleep(wait)
+
+            # Сигнатура отсекает ложные срабатывания (например, события без реальной записи)
+            signature = self.get_signature()
+            if signature != self._last_signature:
+                # Файл мог быть заменен или появиться -wal без событий в каталоге - обновляем наблюдение
+                if self.uses_inotify and self._file_inodes() != self._watched_inodes:
+                    self._add_file_watches()
+                self._last_signature = signature
+                return True